@@ -0,0 +1,156 @@
+import cv2
+import logging
+import numpy as np
+
+from frame_metrics import frame_metrics
+
+logger = logging.getLogger(__name__)
+
+MIN_AREA = 100
+MAX_AREA = 1000
+MIN_CIRCULARITY = 0.5
+MAX_ANOMALIES = 3
+FACE_PADDING = 0.2  # Padding around each face box, as a fraction of its size
+FULL_FRAME_DOWNSCALE = 0.5  # Scale of the fallback full-frame pass
+
+def _find_white_patches(image, min_area=MIN_AREA, max_area=MAX_AREA):
+    """
+    Find small white patches (electrical tape) with colour segmentation in HSV.
+    Returns (list of (center_x, center_y, radius, area), number of blobs).
+    """
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    # White patch mask: stricter thresholds to avoid spurious detections
+    white_mask = cv2.inRange(hsv, (0, 0, 200), (180, 50, 255))
+
+    # Clean mask with morphological operations
+    kernel = np.ones((3,3), np.uint8)
+    white_mask = cv2.morphologyEx(white_mask, cv2.MORPH_OPEN, kernel)
+
+    # Area and bounding box for every blob in one pass. Label 0 is the background.
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(white_mask, connectivity=8)
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+
+    # Exact pre-filters, so the contour checks below see the same survivors the
+    # full contour scan did: a contour's area never exceeds its bounding box,
+    # and a contour that passes the circularity test with area <= max_area has
+    # perimeter <= sqrt(4*pi*max_area / MIN_CIRCULARITY), which caps its extent.
+    max_extent = 1 + np.sqrt(4 * np.pi * max_area / MIN_CIRCULARITY) / 2
+    keep = (widths * heights >= min_area) & (np.maximum(widths, heights) <= max_extent)
+    outside = _outside_border(white_mask) if keep.any() else None
+
+    patches = []
+    for label in np.flatnonzero(keep) + 1:
+        x, y, w, h = stats[label, :4]
+        blob = (labels[y:y+h, x:x+w] == label).astype(np.uint8)
+        # RETR_EXTERNAL skips blobs sitting inside a hole of another blob
+        if not outside[y:y+h, x:x+w][blob.astype(bool)].any():
+            continue
+        contours, _ = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x), int(y)))
+        cnt = contours[0]
+
+        area = cv2.contourArea(cnt)
+        if area < min_area or area > max_area:
+            continue
+
+        # Filter by circularity to prefer round/compact shapes
+        perimeter = cv2.arcLength(cnt, True)
+        if perimeter == 0:
+            continue
+        circularity = 4 * np.pi * area / (perimeter * perimeter)
+        if circularity < MIN_CIRCULARITY:  # Not too elongated
+            continue
+
+        # Get bounding circle
+        (cx, cy), radius = cv2.minEnclosingCircle(cnt)
+        patches.append((int(cx), int(cy), int(radius), area))
+
+    frame_metrics.incr('anomaly_blobs', count - 1)
+    frame_metrics.incr('anomaly_candidates', int(keep.sum()))
+    if frame_metrics.sample():
+        logger.debug("Image size: %s, White blobs: %d, Candidates: %d, Patches: %d",
+                     image.shape, count - 1, keep.sum(), len(patches))
+    return patches, count - 1
+
+def _outside_border(mask):
+    """
+    Mask of white pixels next to the background that reaches the image edge.
+    A blob with none lies in a hole of another blob. The background is
+    4-connected, as in findContours, and the frame is padded so a region
+    open to the edge counts as outside.
+    """
+    background = cv2.copyMakeBorder(cv2.bitwise_not(mask), 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=255)
+    _, regions = cv2.connectedComponents(background, connectivity=4)
+    outer = (regions == regions[0, 0]).astype(np.uint8)
+    cross = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+    return (cv2.dilate(outer, cross)[1:-1, 1:-1] > 0) & (mask > 0)
+
+def _top_anomalies(patches):
+    """Keep the largest MAX_ANOMALIES patches and drop the area from each tuple."""
+    if len(patches) > MAX_ANOMALIES:
+        areas = np.array([p[3] for p in patches])
+        top = np.argpartition(-areas, MAX_ANOMALIES - 1)[:MAX_ANOMALIES]
+        patches = [patches[i] for i in top]
+    patches = sorted(patches, key=lambda p: p[3], reverse=True)
+    return [(x, y, r) for x, y, r, a in patches]
+
+def detect_skin_anomalies(face_roi):
+    """
+    Detect small white patches (electrical tape).
+    Uses color segmentation in HSV space.
+    Returns list of (center_x, center_y, radius) for detected anomalies.
+    """
+    try:
+        if face_roi.size == 0:
+            return []
+        patches, _ = _find_white_patches(face_roi)
+        return _top_anomalies(patches)
+    except Exception as e:
+        logger.error("Error in anomaly detection: %s", e)
+        return []
+
+def detect_anomalies_in_faces(frame, faces, padding=FACE_PADDING):
+    """
+    Run anomaly detection only inside the (padded) face rectangles and map
+    the results back to frame coordinates.
+    """
+    try:
+        height, width = frame.shape[:2]
+        patches = []
+        for (x, y, w, h) in faces:
+            pad_x, pad_y = int(w * padding), int(h * padding)
+            x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+            x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+            roi = frame[y0:y1, x0:x1]
+            if roi.size == 0:
+                continue
+            found, _ = _find_white_patches(roi)
+            for (cx, cy, r, area) in found:
+                cx, cy = cx + x0, cy + y0
+                # Padded ROIs of neighbouring faces can overlap; keep one copy of a patch
+                if any(abs(cx - px) <= r and abs(cy - py) <= r for px, py, _, _ in patches):
+                    continue
+                patches.append((cx, cy, r, area))
+        return _top_anomalies(patches)
+    except Exception as e:
+        logger.error("Error in anomaly detection: %s", e)
+        return []
+
+def detect_anomalies_downscaled(frame, scale=FULL_FRAME_DOWNSCALE):
+    """
+    Full-frame anomaly detection on a downscaled copy. Area limits are scaled
+    to match, and results are mapped back to full-resolution coordinates.
+    """
+    try:
+        if frame.size == 0:
+            return []
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        area_scale = scale * scale
+        patches, _ = _find_white_patches(small, MIN_AREA * area_scale, MAX_AREA * area_scale)
+        inv = 1.0 / scale
+        patches = [(int(x * inv), int(y * inv), int(r * inv), area) for x, y, r, area in patches]
+        return _top_anomalies(patches)
+    except Exception as e:
+        logger.error("Error in anomaly detection: %s", e)
+        return []
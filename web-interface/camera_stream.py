@@ -0,0 +1,225 @@
+import cv2
+import time
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class CameraStream:
+    """
+    Single producer for the camera. A background thread owns the capture
+    device and publishes every frame once into a small ring buffer tagged
+    with a sequence number; any number of consumers read from the buffer
+    without touching the device.
+
+    `source` is anything with cv2.VideoCapture's read()/release() interface,
+    so a fake source can be passed in for benchmarking. A failed read does
+    not end the stream: the thread backs off (doubling up to `max_backoff`
+    seconds) and, if `reopen` is given, replaces the source with `reopen()`
+    before trying again. Consumers keep waiting and resume when frames do.
+    """
+    def __init__(self, source, buffer_size=4, reopen=None, max_backoff=5.0):
+        self.source = source
+        self.reopen = reopen
+        self.max_backoff = max_backoff
+        self.buffer_size = buffer_size
+        self.buffer = [None] * buffer_size  # (seq, frame) slots
+        self.seq = 0
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = None
+        self.listeners = []
+        self.stats = {'frames': 0, 'read_errors': 0, 'reopens': 0, 'started_at': None}
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.stats['started_at'] = time.time()
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+        self.source.release()
+
+    def add_listener(self, callback):
+        """Register `callback(seq, frame)` to be called from the capture thread for every frame."""
+        self.listeners.append(callback)
+
+    def get_latest(self):
+        """Return (seq, frame) for the newest frame, or (0, None) before the first one."""
+        with self.condition:
+            if self.seq == 0:
+                return 0, None
+            return self.buffer[self.seq % self.buffer_size]
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """Block until a frame newer than `last_seq` is published and return it."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > last_seq or not self.running, timeout):
+                return last_seq, None
+            if self.seq <= last_seq:
+                return last_seq, None
+            return self.buffer[self.seq % self.buffer_size]
+
+    def frames(self):
+        """Generator yielding (seq, frame) for each new frame; skips frames a slow consumer missed."""
+        last_seq = 0
+        while self.running:
+            seq, frame = self.wait_for_frame(last_seq)
+            if frame is None:
+                continue
+            last_seq = seq
+            yield seq, frame
+
+    def _capture_loop(self):
+        logger.info("Camera capture thread started...")
+        backoff = 0.1
+        while self.running:
+            success, frame = self.source.read()
+            if not success:
+                self.stats['read_errors'] += 1
+                logger.error("Camera read failed, retrying in %.1f s", backoff)
+                with self.condition:
+                    # Woken early by stop()
+                    self.condition.wait_for(lambda: not self.running, backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                if self.running and self.reopen is not None:
+                    self._reopen()
+                continue
+            backoff = 0.1
+            with self.condition:
+                self.seq += 1
+                self.buffer[self.seq % self.buffer_size] = (self.seq, frame)
+                self.condition.notify_all()
+            self.stats['frames'] += 1
+            for callback in self.listeners:
+                try:
+                    callback(self.seq, frame)
+                except Exception as e:
+                    logger.error("Error in frame listener: %s", e)
+
+    def _reopen(self):
+        try:
+            self.source.release()
+            self.source = self.reopen()
+            self.stats['reopens'] += 1
+        except Exception as e:
+            logger.error("Error reopening camera: %s", e)
+
+class FrameEncoder:
+    """
+    Encode-once cache for the MJPEG stream. The first subscriber to ask for
+    a sequence number renders it, and each (quality, scale) profile is
+    encoded once per frame; every other subscriber on that profile gets the
+    same preassembled multipart chunk.
+    """
+    HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+    TRAILER = b'\r\n'
+
+    def __init__(self, quality=70):
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.rendered_seq = 0
+        self.rendered = None
+        self.rendered_is_source = False  # True when render() drew nothing and returned the capture frame
+        self.chunks = {}  # (quality, scale) -> (seq, chunk)
+        self.stats = {'rendered': 0, 'encoded': 0, 'served': 0, 'encode_time': 0.0}
+
+    def get_chunk(self, seq, frame, render=None, quality=None, scale=1.0):
+        """
+        Return the multipart chunk for frame `seq`. `render(seq, frame)` is
+        called at most once per sequence number to draw overlays before
+        encoding. `scale` resizes the rendered frame before encoding.
+        """
+        quality = quality or self.quality
+        key = (quality, scale)
+        with self.lock:
+            # A consumer that fell behind gets the newer cached chunk instead
+            # of forcing a re-render of a stale frame
+            if seq > self.rendered_seq:
+                start = time.perf_counter()
+                self.rendered = render(seq, frame) if render is not None else frame
+                self.rendered_is_source = self.rendered is frame
+                self.rendered_seq = seq
+                self.stats['rendered'] += 1
+                self.stats['encode_time'] += time.perf_counter() - start
+
+            cached = self.chunks.get(key)
+            if cached is None or cached[0] < self.rendered_seq:
+                start = time.perf_counter()
+                image = self.rendered
+                if scale != 1.0:
+                    image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                ret, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                if ret:
+                    # join() copies straight out of the encoder's buffer, so the
+                    # JPEG bytes are copied exactly once per frame
+                    cached = self.chunks[key] = (self.rendered_seq, b''.join((self.HEADER, buffer, self.TRAILER)))
+                self.stats['encoded'] += 1
+                self.stats['encode_time'] += time.perf_counter() - start
+            self.stats['served'] += 1
+            return cached[1] if cached is not None else None
+
+    def cached_jpeg(self, seq, min_quality):
+        """
+        JPEG bytes already encoded for frame `seq` at full resolution and at
+        least `min_quality`, or None. Only frames encoded without overlays
+        qualify, so the result matches the pristine sensor frame.
+        """
+        with self.lock:
+            if self.rendered_seq != seq or not self.rendered_is_source:
+                return None
+            for (quality, scale), (chunk_seq, chunk) in self.chunks.items():
+                if chunk_seq == seq and scale == 1.0 and quality >= min_quality:
+                    return memoryview(chunk)[len(self.HEADER):-len(self.TRAILER)]
+        return None
+
+class FrameBufferPool:
+    """
+    Reusable full-frame buffers for drawing overlays, so annotating a frame
+    doesn't allocate. Buffers are handed out round-robin, skipping the one
+    the caller excludes (the frame the encoder may still encode). If no
+    buffer is free the pool grows by one.
+    """
+    def __init__(self, size=3):
+        self.size = size
+        self.lock = threading.Lock()
+        self.buffers = []
+        self.next = 0
+        self.stats = {'allocations': 0, 'reuses': 0}
+
+    def copy_of(self, frame, exclude=None):
+        """Copy `frame` into a free pooled buffer and return the buffer."""
+        buffer = self._acquire(frame.shape, frame.dtype, exclude)
+        np.copyto(buffer, frame)
+        return buffer
+
+    def _acquire(self, shape, dtype, exclude):
+        with self.lock:
+            for _ in range(len(self.buffers)):
+                index = self.next
+                self.next = (self.next + 1) % len(self.buffers)
+                buffer = self.buffers[index]
+                if buffer is exclude:
+                    continue
+                if buffer.shape == shape and buffer.dtype == dtype:
+                    self.stats['reuses'] += 1
+                    return buffer
+                # Resolution changed; replace the stale buffer in its slot
+                buffer = self.buffers[index] = np.empty(shape, dtype)
+                self.stats['allocations'] += 1
+                return buffer
+
+            buffer = np.empty(shape, dtype)
+            self.buffers.append(buffer)
+            self.stats['allocations'] += 1
+            if len(self.buffers) > self.size:
+                logger.debug("Frame buffer pool grew to %d buffers", len(self.buffers))
+            return buffer
@@ -12,15 +12,47 @@ STEPS_PER_REV_M2 = 600   # Top motor
 MICROSTEPPING = 8
 DEG_PER_STEP_M1 = 360 / (STEPS_PER_REV_M1 * MICROSTEPPING)
 DEG_PER_STEP_M2 = 360 / (STEPS_PER_REV_M2 * MICROSTEPPING)
-STEP_DELAY = 0.003
+STEP_DELAY = 0.003  # Half of the slowest step period; moves start and stop at this rate
+MAX_STEP_RATE = 2000  # Cruise speed, steps/s
+STEP_ACCELERATION = 4000  # steps/s^2
+STEP_JERK = 20000  # steps/s^3; 0 for a trapezoidal profile
+STEP_BACKEND = 'auto'  # 'pigpio' (DMA-timed), 'rpi_gpio' (software-timed), 'simulated' or 'auto'
+STEP_CHUNK_TIME = 0.02  # Seconds of steps queued to the backend at once
 
 # Temi Configuration
 MQTT_HOST = os.getenv('MQTT_HOST', 'localhost')
 MQTT_PORT = int(os.getenv('MQTT_PORT', 1883))
 TEMI_SERIAL = os.getenv('TEMI_SERIAL', 'xxxxxxxxxxx') # Add Temi Serial Here
 
+# Camera & Streaming
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+STREAM_TARGET_LATENCY = 0.15  # Seconds; per-client stream quality adapts to stay under this
+
+# Face Detection
+DETECTION_DOWNSCALE = 0.5  # Pyramid level searched by 'haar_multires'
+TRACKING_REDETECT_INTERVAL = 15  # Frames between full detections in 'haar_tracking'
+TRACKING_MIN_CONFIDENCE = 0.5  # Re-detect early when fewer tracked points survive
+
+# Metrics
+METRICS_FLUSH_INTERVAL = 30.0  # Seconds between aggregated frame-metrics log lines
+METRICS_DEBUG_SAMPLE_RATE = 0.05  # Fraction of frames that emit a debug log line
+
 # Storage
 STORAGE_FOLDER = 'secure_dicom_storage'
+DICOM_TRANSFER_SYNTAX = 'explicit'  # 'explicit' (uncompressed), 'jpeg_baseline', 'jpeg_ls' (needs pyjpegls) or 'rle'
+DICOM_JPEG_QUALITY = 90  # Used when a capture is JPEG-encoded for storage
+DICOM_STREAM_JPEG_MIN_QUALITY = 70  # Reuse the stream's JPEG for jpeg_baseline if at least this quality
+DICOM_QUEUE_FRAMES = 64  # Frames held for the writer (~60 MB at 640x480) before captures return 503
+DICOM_FSYNC_BATCH = 8  # Files written between fsyncs (also synced whenever the queue drains)
+BURST_MAX_FRAMES = 30
+BURST_MAX_DURATION = 10.0  # Seconds
+SWEEP_MAX_POSITIONS = 60
+SWEEP_MOVE_TIMEOUT = 30.0  # Seconds allowed for the arm to reach each sweep position
+SWEEP_SETTLE_TIME = 0.2  # Seconds to let the arm settle before grabbing a frame
+PREVIEW_FOLDER = 'secure_dicom_storage/previews'
+PREVIEW_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Least recently served previews are deleted past this size
+CAPTURE_LIST_MAX_LIMIT = 500  # Largest page /captures will return
 
 # Flask Config
 HOST = '0.0.0.0'
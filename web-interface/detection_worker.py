@@ -0,0 +1,96 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class DetectionWorker:
+    """
+    Runs frame analysis off the streaming path. The capture loop hands over
+    the newest frame with submit(); if the worker is still busy the pending
+    frame is replaced, so it always works on the freshest frame and never
+    builds a backlog. Results are tagged with the sequence number of the
+    frame they were computed from.
+    """
+    def __init__(self, analyze):
+        self.analyze = analyze
+        self.condition = threading.Condition()
+        self.pending = None  # (seq, frame) waiting to be analysed
+        self.result = (0, None)  # (source seq, analysis result)
+        self.generation = 0  # bumped by clear() to discard in-flight results
+        self.running = False
+        self.thread = None
+        self.stats = {'submitted': 0, 'processed': 0, 'dropped': 0, 'errors': 0,
+                      'busy_time': 0.0, 'last_ms': 0.0, 'started_at': None}
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.stats['started_at'] = time.time()
+        self.thread = threading.Thread(target=self._worker_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def submit(self, seq, frame):
+        with self.condition:
+            self.stats['submitted'] += 1
+            if self.pending is not None:
+                self.stats['dropped'] += 1
+            self.pending = (seq, frame)
+            self.condition.notify()
+
+    def latest(self):
+        """Return (seq, result) for the most recent finished analysis."""
+        with self.condition:
+            return self.result
+
+    def clear(self):
+        with self.condition:
+            self.pending = None
+            self.result = (0, None)
+            self.generation += 1
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['result_seq'] = self.result[0]
+        elapsed = time.time() - stats['started_at'] if stats['started_at'] else 0
+        stats['throughput_fps'] = stats['processed'] / elapsed if elapsed > 0 else 0.0
+        stats['avg_ms'] = 1000 * stats['busy_time'] / stats['processed'] if stats['processed'] else 0.0
+        return stats
+
+    def _worker_loop(self):
+        logger.info("Detection worker thread started...")
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or not self.running)
+                if not self.running:
+                    break
+                seq, frame = self.pending
+                self.pending = None
+                generation = self.generation
+
+            start = time.perf_counter()
+            try:
+                result = self.analyze(frame)
+            except Exception as e:
+                logger.error("Error in detection worker: %s", e)
+                with self.condition:
+                    self.stats['errors'] += 1
+                continue
+            duration = time.perf_counter() - start
+
+            with self.condition:
+                # A clear() while analysing makes this result stale
+                if generation == self.generation:
+                    self.result = (seq, result)
+                self.stats['processed'] += 1
+                self.stats['busy_time'] += duration
+                self.stats['last_ms'] = duration * 1000
@@ -1,73 +1,436 @@
 import os
+import cv2
+import copy
+import json
+import time
 import datetime
+import threading
 import numpy as np
 import pydicom
-from pydicom.dataset import FileDataset, FileMetaDataset
-from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+from pydicom.datadict import dictionary_VR, tag_for_keyword
+from pydicom.dataelem import DataElement
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.tag import Tag
+from pydicom.encaps import encapsulate
+try:
+    from pydicom.encaps import generate_frames
+except ImportError:  # pydicom < 3
+    from pydicom.encaps import generate_pixel_data_frame as generate_frames
+try:
+    from pydicom.pixels import get_encoder
+except ImportError:  # pydicom < 3
+    from pydicom.encoders import get_encoder
+from pydicom.uid import ExplicitVRLittleEndian, JPEGBaseline8Bit, JPEGLSLossless, RLELossless, PYDICOM_IMPLEMENTATION_UID, generate_uid
 from werkzeug.utils import secure_filename
 import logging
 
+from dicom_index import DICOMIndex
+
 logger = logging.getLogger(__name__)
 
+TRANSFER_SYNTAXES = {
+    'explicit': ExplicitVRLittleEndian,
+    'jpeg_baseline': JPEGBaseline8Bit,
+    'jpeg_ls': JPEGLSLossless,
+    'rle': RLELossless,
+}
+
+SC_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.7'
+MULTIFRAME_SC_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.7.4'  # Multi-frame True Color Secondary Capture
+
+# Tag and VR of every attribute set per save, looked up once. Building these
+# elements directly skips the keyword lookup and checks of ds.Keyword = value,
+# which would otherwise cost more than the template saves.
+PER_SAVE_ELEMENTS = {keyword: (Tag(tag_for_keyword(keyword)), dictionary_VR(keyword)) for keyword in (
+    'MediaStorageSOPInstanceUID', 'SOPInstanceUID', 'StudyDate', 'StudyTime', 'PatientName', 'PatientID',
+    'PatientSex', 'PatientAge', 'StudyInstanceUID', 'SeriesInstanceUID', 'InstanceNumber')}
+
+def _element(keyword, value):
+    tag, vr = PER_SAVE_ELEMENTS[keyword]
+    return tag, DataElement(tag, vr, value)
+
+class MultiFrameCapture:
+    """Frames collected for one multi-frame object, with per-frame motor angles and timestamps."""
+    def __init__(self):
+        self.frames = []
+        self.positions = []
+        self.timestamps = []
+
+    def append(self, image_array, motor_positions, timestamp=None):
+        if self.frames and image_array.shape != self.frames[0].shape:
+            raise ValueError("All frames in a multi-frame capture must have the same size")
+        self.frames.append(image_array)
+        self.positions.append(dict(motor_positions))
+        self.timestamps.append(timestamp or datetime.datetime.now())
+
+    def frame_time(self):
+        """Mean seconds between frames."""
+        if len(self.timestamps) < 2:
+            return 0.0
+        return (self.timestamps[-1] - self.timestamps[0]).total_seconds() / (len(self.timestamps) - 1)
+
 class DICOMHandler:
-    def __init__(self, storage_folder):
+    def __init__(self, storage_folder, transfer_syntax='explicit', jpeg_quality=90, preview_cache=None):
+        if transfer_syntax not in TRANSFER_SYNTAXES:
+            raise ValueError(f"Unknown transfer syntax: {transfer_syntax}")
+        if transfer_syntax in ('jpeg_ls', 'rle'):
+            # Fail at startup rather than storing every capture uncompressed
+            encoder = get_encoder(TRANSFER_SYNTAXES[transfer_syntax])
+            if not encoder.is_available:
+                raise ValueError(f"No encoder installed for {transfer_syntax}: "
+                                 f"{'; '.join(encoder.missing_dependencies)}")
         self.storage_folder = storage_folder
-        if not os.path.exists(self.storage_folder):
-            os.makedirs(self.storage_folder)
-            os.chmod(self.storage_folder, 0o700)
+        self.transfer_syntax = transfer_syntax
+        self.jpeg_quality = jpeg_quality
+        self.preview_cache = preview_cache  # Optional PreviewCache filled at save time
+        self.stats = {}  # syntax -> {'count', 'bytes', 'encode_time', 'save_time'}
+        # (patient_id, date) -> {'study_uid', 'series_uid', 'instances'}: one
+        # study per patient per day, with one series for all its single captures
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        # Attributes that never change within a session, built once and cloned per save
+        self.templates = {sop_class_uid: self._build_template(sop_class_uid)
+                          for sop_class_uid in (SC_IMAGE_STORAGE, MULTIFRAME_SC_IMAGE_STORAGE)}
+        # Element range the templates reserved for the RoboticCamera block
+        self.private_block_start = self.templates[SC_IMAGE_STORAGE].private_block(0x0019, "RoboticCamera").block_start
+        # Enforced even if the folder already exists, e.g. created 0755 as
+        # the parent of the preview cache
+        self._makedirs_private(self.storage_folder)
+        os.chmod(self.storage_folder, 0o700)
+        self.index = DICOMIndex(os.path.join(self.storage_folder, 'index.sqlite3'))
+
+    def _session(self, metadata):
+        """
+        This patient's session for today. Reusing its study and series keeps
+        a patient's captures in one directory instead of two new directories
+        per capture. Caller holds sessions_lock.
+        """
+        key = (metadata.get('patient_id', '000000'), datetime.date.today())
+        session = self.sessions.get(key)
+        if session is None:
+            # Earlier days' sessions are finished
+            self.sessions = {k: v for k, v in self.sessions.items() if k[1] == key[1]}
+            session = self.sessions[key] = {'study_uid': generate_uid(), 'series_uid': generate_uid(), 'instances': 0}
+        return session
+
+    def next_single_capture(self, metadata):
+        """(series, instance number) for the next single capture in the patient's session."""
+        with self.sessions_lock:
+            session = self._session(metadata)
+            session['instances'] += 1
+            return {'study_uid': session['study_uid'], 'series_uid': session['series_uid']}, session['instances']
 
-    def save_as_dicom(self, image_array, metadata, motor_positions):
+    def new_series(self, metadata):
+        """A fresh series (e.g. for a burst or sweep) in the patient's study for today."""
+        with self.sessions_lock:
+            return {'study_uid': self._session(metadata)['study_uid'], 'series_uid': generate_uid()}
+
+    def save_as_dicom(self, image_array, metadata, motor_positions, overlays=None, series=None, instance_number=1,
+                      jpeg=None):
+        """
+        Save an RGB image. Without `series` it is a single capture and joins
+        the patient's session series. `jpeg` may carry an already-encoded
+        JPEG of the same pixels (e.g. from the stream cache); it is stored
+        as-is when the handler writes JPEG baseline.
+        """
         try:
+            started = time.perf_counter()
+            now = datetime.datetime.now()
+            if series is None:
+                series, instance_number = self.next_single_capture(metadata)
             angle_m1 = motor_positions.get('m1', 0)
             angle_m2 = motor_positions.get('m2', 0)
 
-            file_meta = FileMetaDataset()
-            file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.7'
-            file_meta.MediaStorageSOPInstanceUID = generate_uid()
-            file_meta.ImplementationClassUID = generate_uid()
-            file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
-
-            ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
-            ds.PatientName = metadata.get('patient_name', 'Anonymous')
-            ds.PatientID = metadata.get('patient_id', '000000')
-            ds.PatientSex = metadata.get('patient_sex', '')
-            patient_age = metadata.get('patient_age', '')
-            if patient_age:
-                try:
-                    age_int = int(float(patient_age))
-                    ds.PatientAge = f"{age_int:03d}Y"
-                except:
-                    pass
-            ds.StudyDate = datetime.datetime.now().strftime('%Y%m%d')
-            ds.StudyTime = datetime.datetime.now().strftime('%H%M%S')
-            ds.Modality = 'OT'
+            ds = self._build_dataset(SC_IMAGE_STORAGE, metadata, series, instance_number, now)
 
             # Custom Data
             ds.ImageComments = f"M1_Angle:{angle_m1:.2f}, M2_Angle:{angle_m2:.2f}"
-            block = ds.private_block(0x0019, "RoboticCamera", create=True)
-            block.add_new(0x01, 'DS', str(round(angle_m1, 2)))
-            block.add_new(0x02, 'DS', str(round(angle_m2, 2)))
-
-            ds.SamplesPerPixel = 3
-            ds.PhotometricInterpretation = "RGB"
-            ds.PlanarConfiguration = 0
-            ds.Rows = image_array.shape[0]
-            ds.Columns = image_array.shape[1]
-            ds.BitsAllocated = 8
-            ds.BitsStored = 8
-            ds.HighBit = 7
-            ds.PixelRepresentation = 0
-            ds.PixelData = image_array.tobytes()
-            ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
-            ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
-
-            safe_id = secure_filename(ds.PatientID)
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{safe_id}_{timestamp}.dcm"
-            filepath = os.path.join(self.storage_folder, filename)
-            ds.save_as(filepath)
-            logger.info(f"DICOM saved: {filename}")
+            ds.add(self._private_element(0x01, 'DS', str(round(angle_m1, 2))))
+            ds.add(self._private_element(0x02, 'DS', str(round(angle_m2, 2))))
+            if overlays:
+                # Detection overlays (face rects, anomaly circles in pixel
+                # coordinates) are kept as data; the stored pixels are clean
+                ds.add(self._private_element(0x03, 'UT', json.dumps(overlays)))
+
+            syntax, encode_time = self._set_pixel_data(ds, [image_array], [jpeg])
+            filename = self._write(ds, syntax, encode_time, motor_positions, now, started)
+            self._write_previews(ds.SOPInstanceUID, image_array)
             return filename
         except Exception as e:
             logger.error(f"Error saving DICOM: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def save_multiframe(self, capture, metadata, series=None):
+        """
+        Save a MultiFrameCapture as one multi-frame object. Each frame's motor
+        angles and acquisition time go in a per-frame private sequence
+        (RoboticCamera 0019,xx10) instead of a separate file per frame.
+        """
+        try:
+            started = time.perf_counter()
+            if not capture.frames:
+                raise ValueError("No frames captured")
+            if series is None:
+                series = self.new_series(metadata)
+
+            ds = self._build_dataset(MULTIFRAME_SC_IMAGE_STORAGE, metadata, series, 1, capture.timestamps[0])
+            ds.NumberOfFrames = len(capture.frames)
+            ds.FrameIncrementPointer = Tag(0x0018, 0x1063)  # FrameTime
+            ds.FrameTime = round(capture.frame_time() * 1000, 3)
+            ds.ImageComments = f"Motor sweep, {len(capture.frames)} frames"
+
+            per_frame = []
+            for positions, timestamp in zip(capture.positions, capture.timestamps):
+                item = Dataset()
+                item_block = item.private_block(0x0019, "RoboticCamera", create=True)
+                item_block.add_new(0x01, 'DS', str(round(positions.get('m1', 0), 2)))
+                item_block.add_new(0x02, 'DS', str(round(positions.get('m2', 0), 2)))
+                item_block.add_new(0x04, 'DT', timestamp.strftime('%Y%m%d%H%M%S.%f'))
+                per_frame.append(item)
+            ds.add(self._private_element(0x10, 'SQ', per_frame))
+
+            syntax, encode_time = self._set_pixel_data(ds, capture.frames)
+            # The index records where the sweep started
+            filename = self._write(ds, syntax, encode_time, capture.positions[0], capture.timestamps[0], started)
+            self._write_previews(ds.SOPInstanceUID, capture.frames[0])
+            return filename
+        except Exception as e:
+            logger.error(f"Error saving multi-frame DICOM: {e}")
+            raise
+
+    def _build_template(self, sop_class_uid):
+        """Dataset holding every attribute shared by all captures of one SOP class."""
+        file_meta = FileMetaDataset()
+        file_meta.MediaStorageSOPClassUID = sop_class_uid
+        file_meta.ImplementationClassUID = PYDICOM_IMPLEMENTATION_UID
+        file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+        ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
+        ds.Modality = 'OT'
+        ds.SamplesPerPixel = 3
+        ds.PhotometricInterpretation = "RGB"
+        ds.PlanarConfiguration = 0
+        ds.BitsAllocated = 8
+        ds.BitsStored = 8
+        ds.HighBit = 7
+        ds.PixelRepresentation = 0
+        ds.SOPClassUID = sop_class_uid
+        ds.private_block(0x0019, "RoboticCamera", create=True)
+        return ds
+
+    def _build_dataset(self, sop_class_uid, metadata, series, instance_number, now):
+        template = self.templates[sop_class_uid]
+        sop_instance_uid = generate_uid()
+        # Template values are all immutable, so a shallow copy of each
+        # element is a complete clone and much cheaper than deepcopy()
+        meta_elements = {elem.tag: copy.copy(elem) for elem in template.file_meta}
+        meta_elements.update([_element('MediaStorageSOPInstanceUID', sop_instance_uid)])
+        elements = {elem.tag: copy.copy(elem) for elem in template}
+        elements.update([
+            _element('SOPInstanceUID', sop_instance_uid),
+            _element('PatientName', metadata.get('patient_name', 'Anonymous')),
+            _element('PatientID', metadata.get('patient_id', '000000')),
+            _element('PatientSex', metadata.get('patient_sex', '')),
+            _element('StudyDate', now.strftime('%Y%m%d')),
+            _element('StudyTime', now.strftime('%H%M%S')),
+            _element('StudyInstanceUID', series['study_uid']),
+            _element('SeriesInstanceUID', series['series_uid']),
+            _element('InstanceNumber', instance_number),
+        ])
+        patient_age = metadata.get('patient_age', '')
+        if patient_age:
+            try:
+                age_int = int(float(patient_age))
+                elements.update([_element('PatientAge', f"{age_int:03d}Y")])
+            except:
+                pass
+        return FileDataset(None, elements, file_meta=FileMetaDataset(meta_elements), preamble=template.preamble)
+
+    def _private_element(self, offset, vr, value):
+        """
+        RoboticCamera element `offset` for a dataset cloned from a template.
+        Same tag as private_block(...).add_new(), without the block lookup.
+        """
+        return DataElement(Tag(0x0019, self.private_block_start + offset), vr, value)
+
+    def storage_path(self, ds):
+        """
+        Path of a dataset relative to the storage folder:
+        <patient>/<study>/<series>/<SOPInstanceUID>.dcm. UID-based names never
+        collide, and sharding keeps each directory small.
+        """
+        safe_id = secure_filename(str(ds.PatientID)) or 'unknown'
+        return os.path.join(safe_id, ds.StudyInstanceUID, ds.SeriesInstanceUID, f"{ds.SOPInstanceUID}.dcm")
+
+    def _write(self, ds, syntax, encode_time, motor_positions, captured_at, started):
+        """Write the dataset into the sharded layout, index it, and return its relative path."""
+        # Some encoders assign a fresh SOPInstanceUID; keep the file meta in step
+        ds.file_meta.MediaStorageSOPInstanceUID = ds.SOPInstanceUID
+        filename = self.storage_path(ds)
+        filepath = os.path.join(self.storage_folder, filename)
+        self._makedirs_private(os.path.dirname(filepath))
+        ds.save_as(filepath)
+        os.chmod(filepath, 0o600)
+        size = os.path.getsize(filepath)
+
+        self.index.add({
+            'sop_instance_uid': ds.SOPInstanceUID,
+            'patient_id': str(ds.PatientID),
+            'patient_name': str(ds.PatientName),
+            'study_instance_uid': ds.StudyInstanceUID,
+            'series_instance_uid': ds.SeriesInstanceUID,
+            'instance_number': int(ds.InstanceNumber),
+            'captured_at': captured_at.isoformat(),
+            'm1_angle': motor_positions.get('m1'),
+            'm2_angle': motor_positions.get('m2'),
+            'number_of_frames': int(ds.get('NumberOfFrames', 1)),
+            'transfer_syntax': syntax,
+            'path': filename,
+            'size': size,
+        })
+        self._record(syntax, size, encode_time, time.perf_counter() - started)
+        logger.info("DICOM saved: %s (%s, %d bytes, encode %.1f ms)", filename, syntax, size, encode_time * 1000)
+        return filename
+
+    def _write_previews(self, sop_instance_uid, image_array):
+        """Render previews from the in-memory pixels; the capture is already saved, so failures only log."""
+        if self.preview_cache is None:
+            return
+        try:
+            self.preview_cache.write_all(sop_instance_uid, image_array)
+        except Exception as e:
+            logger.warning("Preview generation failed for %s: %s", sop_instance_uid, e)
+
+    def file_path(self, sop_instance_uid):
+        """Absolute path of an indexed capture, or None if it isn't in the index."""
+        record = self.index.get(sop_instance_uid)
+        if record is None:
+            return None
+        return os.path.join(self.storage_folder, record['path'])
+
+    def read_header(self, sop_instance_uid):
+        """
+        Capture metadata read from the file header only; the pixel data is
+        never loaded. Returns None for an unknown UID.
+        """
+        filepath = self.file_path(sop_instance_uid)
+        if filepath is None:
+            return None
+        ds = pydicom.dcmread(filepath, stop_before_pixels=True)
+        header = {
+            'sop_instance_uid': ds.SOPInstanceUID,
+            'sop_class_uid': ds.SOPClassUID,
+            'transfer_syntax_uid': ds.file_meta.TransferSyntaxUID,
+            'patient_name': str(ds.get('PatientName', '')),
+            'patient_id': ds.get('PatientID', ''),
+            'patient_sex': ds.get('PatientSex', ''),
+            'patient_age': ds.get('PatientAge', ''),
+            'study_instance_uid': ds.StudyInstanceUID,
+            'series_instance_uid': ds.SeriesInstanceUID,
+            'instance_number': int(ds.get('InstanceNumber', 1)),
+            'study_date': ds.get('StudyDate', ''),
+            'study_time': ds.get('StudyTime', ''),
+            'rows': int(ds.Rows),
+            'columns': int(ds.Columns),
+            'number_of_frames': int(ds.get('NumberOfFrames', 1)),
+            'image_comments': ds.get('ImageComments', ''),
+        }
+        try:
+            block = ds.private_block(0x0019, "RoboticCamera")
+        except KeyError:
+            return header
+        if 0x01 in block:
+            header['m1_angle'] = float(block[0x01].value)
+            header['m2_angle'] = float(block[0x02].value)
+        if 0x03 in block:
+            header['overlays'] = json.loads(block[0x03].value)
+        if 0x10 in block:
+            header['frames'] = []
+            for item in block[0x10].value:
+                item_block = item.private_block(0x0019, "RoboticCamera")
+                header['frames'].append({'m1_angle': float(item_block[0x01].value),
+                                         'm2_angle': float(item_block[0x02].value),
+                                         'acquired_at': str(item_block[0x04].value)})
+        return header
+
+    def load_image(self, sop_instance_uid):
+        """First frame of a stored capture as an RGB array."""
+        ds = pydicom.dcmread(self.file_path(sop_instance_uid))
+        if ds.file_meta.TransferSyntaxUID == JPEGBaseline8Bit:
+            # Decode the stored JPEG directly; no pydicom decoder plugin needed
+            fragment = next(generate_frames(ds.PixelData))
+            image = cv2.imdecode(np.frombuffer(fragment, np.uint8), cv2.IMREAD_COLOR)
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        pixels = ds.pixel_array
+        return pixels[0] if int(ds.get('NumberOfFrames', 1)) > 1 else pixels
+
+    def _makedirs_private(self, directory):
+        """
+        Create `directory` and any missing parents as 0700. os.makedirs()
+        only applies its mode to the last level.
+        """
+        missing = []
+        while not os.path.isdir(directory):
+            missing.append(directory)
+            directory = os.path.dirname(directory)
+        for path in reversed(missing):
+            try:
+                os.mkdir(path, 0o700)
+            except FileExistsError:
+                pass
+            os.chmod(path, 0o700)
+
+    def _set_pixel_data(self, ds, frames, jpegs=None):
+        """
+        Store one or more RGB frames in the configured transfer syntax.
+        `jpegs` optionally holds an already-encoded JPEG per frame (or None).
+        Returns (syntax used, encode seconds).
+        """
+        start = time.perf_counter()
+        syntax = self.transfer_syntax
+        ds.Rows = frames[0].shape[0]
+        ds.Columns = frames[0].shape[1]
+        if syntax == 'jpeg_baseline':
+            jpegs = jpegs or [None] * len(frames)
+            fragments = []
+            for image_array, jpeg in zip(frames, jpegs):
+                if jpeg is None:
+                    ok, buffer = cv2.imencode('.jpg', cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR),
+                                              [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+                    if not ok:
+                        raise ValueError("JPEG encoding failed")
+                    jpeg = buffer
+                fragments.append(bytes(jpeg))
+            ds.PhotometricInterpretation = "YBR_FULL_422"
+            ds.LossyImageCompression = '01'
+            ds.LossyImageCompressionMethod = 'ISO_10918_1'
+            ds.PixelData = encapsulate(fragments)
+            ds['PixelData'].VR = 'OB'
+            ds.file_meta.TransferSyntaxUID = JPEGBaseline8Bit
+        else:
+            ds.PixelData = b''.join(frames)
+            if syntax != 'explicit':
+                # The encoder was checked when the handler was created
+                pixels = frames[0] if len(frames) == 1 else np.stack(frames)
+                ds.compress(TRANSFER_SYNTAXES[syntax], pixels)
+        return syntax, time.perf_counter() - start
+
+    def _record(self, syntax, size, encode_time, save_time):
+        entry = self.stats.setdefault(syntax, {'count': 0, 'bytes': 0, 'encode_time': 0.0, 'save_time': 0.0})
+        entry['count'] += 1
+        entry['bytes'] += size
+        entry['encode_time'] += encode_time
+        entry['save_time'] += save_time
+
+    def get_stats(self):
+        """
+        Average stored bytes, encode time and total save time per image for
+        each transfer syntax used. `saves_per_second` is the sustained rate
+        the handler could write at (dataset build, encode and file write).
+        """
+        return {syntax: {'count': e['count'],
+                         'avg_bytes': e['bytes'] / e['count'],
+                         'avg_encode_ms': 1000 * e['encode_time'] / e['count'],
+                         'avg_save_ms': 1000 * e['save_time'] / e['count'],
+                         'saves_per_second': e['count'] / e['save_time'] if e['save_time'] else 0.0}
+                for syntax, e in list(self.stats.items())}
@@ -0,0 +1,96 @@
+import os
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captures (
+    sop_instance_uid TEXT PRIMARY KEY,
+    patient_id TEXT NOT NULL,
+    patient_name TEXT,
+    study_instance_uid TEXT NOT NULL,
+    series_instance_uid TEXT NOT NULL,
+    instance_number INTEGER,
+    captured_at TEXT NOT NULL,
+    m1_angle REAL,
+    m2_angle REAL,
+    number_of_frames INTEGER NOT NULL DEFAULT 1,
+    transfer_syntax TEXT,
+    path TEXT NOT NULL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS captures_patient_time ON captures (patient_id, captured_at);
+CREATE INDEX IF NOT EXISTS captures_study ON captures (study_instance_uid, series_instance_uid, instance_number);
+CREATE INDEX IF NOT EXISTS captures_time ON captures (captured_at);
+"""
+
+COLUMNS = ('sop_instance_uid', 'patient_id', 'patient_name', 'study_instance_uid', 'series_instance_uid',
+           'instance_number', 'captured_at', 'm1_angle', 'm2_angle', 'number_of_frames', 'transfer_syntax',
+           'path', 'size')
+
+class DICOMIndex:
+    """
+    SQLite index of saved captures, written at save time, so captures can be
+    looked up by patient, study, time or motor angle without opening files.
+    `captured_at` is an ISO-8601 string so it sorts chronologically.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # The index holds patient names; create it owner-only. SQLite gives
+        # the -wal/-shm files the database file's permissions.
+        os.close(os.open(db_path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.chmod(path, 0o600)
+
+    def add(self, record):
+        values = [record.get(column) for column in COLUMNS]
+        placeholders = ', '.join('?' * len(COLUMNS))
+        with self.lock:
+            self.conn.execute(f"INSERT OR REPLACE INTO captures ({', '.join(COLUMNS)}) VALUES ({placeholders})", values)
+            self.conn.commit()
+
+    def search(self, patient_id=None, study_uid=None, series_uid=None, since=None, until=None, limit=100, offset=0):
+        """
+        Captures matching every given filter, newest first, plus the total
+        match count. `since`/`until` are ISO-8601 strings compared against
+        `captured_at`.
+        """
+        clauses, params = [], []
+        for column, value in (('patient_id', patient_id), ('study_instance_uid', study_uid),
+                              ('series_instance_uid', series_uid)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since:
+            clauses.append("captured_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("captured_at <= ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM captures {where}", params).fetchone()[0]
+            rows = self.conn.execute(
+                f"SELECT * FROM captures {where} ORDER BY captured_at DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows], total
+
+    def get(self, sop_instance_uid):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM captures WHERE sop_instance_uid = ?",
+                                    (sop_instance_uid,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,198 @@
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+from config import DICOM_QUEUE_FRAMES, DICOM_FSYNC_BATCH
+
+logger = logging.getLogger(__name__)
+
+class DICOMWriteQueue:
+    """
+    Queue of DICOM saves drained by a background writer thread, so requests
+    return as soon as the capture is queued. Admission is bounded by frames
+    held in memory, not by jobs: a job counts against `max_frames` from the
+    moment it is admitted (for reserved jobs, before any frame is captured)
+    until it is written or fails. Submitting or reserving raises queue.Full
+    when the frames would not fit. Files are fsynced in batches of
+    `fsync_batch`, or as soon as the queue runs dry.
+    """
+    def __init__(self, handler, max_frames=DICOM_QUEUE_FRAMES, fsync_batch=DICOM_FSYNC_BATCH, history=256):
+        self.handler = handler
+        self.max_frames = max_frames
+        self.fsync_batch = fsync_batch
+        self.history = history
+        self.queue = queue.Queue()
+        self.pending_frames = 0  # Frames admitted and not yet written
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()  # job id -> status dict, oldest first
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, image_array, metadata, motor_positions, overlays=None, jpeg=None):
+        save = (self.handler.save_as_dicom, (image_array, metadata, motor_positions, overlays), {'jpeg': jpeg})
+        return self._enqueue([save], 1)
+
+    def submit_series(self, frames, metadata, series, job_id=None):
+        """
+        Queue a burst as one job. `frames` is a list of (image, motor
+        positions, overlays); every frame shares the series UIDs and gets an
+        incrementing InstanceNumber. `job_id` may name a job reserved for
+        the burst before its frames were collected.
+        """
+        saves = [(self.handler.save_as_dicom, (image, metadata, positions, overlays),
+                  {'series': series, 'instance_number': i + 1})
+                 for i, (image, positions, overlays) in enumerate(frames)]
+        return self._enqueue(saves, len(saves), job_id)
+
+    def reserve(self, frames, status='capturing'):
+        """
+        Create a job before its frames exist (e.g. while a burst or motor
+        sweep is still collecting them), admitting up to `frames` frames
+        now so a busy writer is reported before any capture starts. Raises
+        queue.Full. Finish the job with submit_series(), submit_multiframe()
+        or fail().
+        """
+        return self._new_job(status, 0, frames)
+
+    def submit_multiframe(self, job_id, capture, metadata, series=None):
+        """Queue a reserved job that writes `capture` as a single multi-frame object."""
+        self.progress(job_id, len(capture.frames))
+        save = (self.handler.save_multiframe, (capture, metadata), {'series': series})
+        return self._enqueue([save], len(capture.frames), job_id)
+
+    def progress(self, job_id, frames):
+        """Report how many frames a reserved job has collected so far."""
+        self._update(job_id, frames=frames)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, status='error', error=error)
+
+    def _new_job(self, status, frames, reserved_frames):
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': status, 'filename': None, 'filenames': [], 'frames': frames,
+               'reserved_frames': reserved_frames, 'error': None, 'synced_files': 0, 'submitted_at': time.time()}
+        with self.lock:
+            self._admit(reserved_frames)
+            self.jobs[job_id] = job
+            # Trim finished jobs only; one still holding frames must stay findable
+            while len(self.jobs) > self.history:
+                oldest = next((jid for jid, j in self.jobs.items() if not j['reserved_frames']), None)
+                if oldest is None:
+                    break
+                del self.jobs[oldest]
+        return job_id
+
+    def _enqueue(self, saves, frames, job_id=None):
+        if job_id is None:
+            job_id = self._new_job('queued', len(saves), frames)
+        else:
+            with self.lock:
+                job = self.jobs[job_id]
+                # Settle the reservation at the frames actually captured
+                self._admit(frames - job['reserved_frames'])
+                job['reserved_frames'] = frames
+                job['status'] = 'queued'
+        self.queue.put((job_id, saves))
+        return job_id
+
+    def _admit(self, frames):
+        """Caller holds the lock."""
+        if frames > 0 and self.pending_frames + frames > self.max_frames:
+            raise queue.Full
+        self.pending_frames += frames
+
+    def _finish(self, job_id, **fields):
+        """Mark a job finished and release the frames it held."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return
+            self.pending_frames -= job['reserved_frames']
+            job.update(fields, reserved_frames=0, finished_at=time.time())
+
+    def get_job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+        job['synced'] = job['status'] == 'done' and job['synced_files'] == len(job['filenames'])
+        return job
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def get_stats(self):
+        with self.lock:
+            return {'pending_jobs': self.queue.qsize(), 'pending_frames': self.pending_frames,
+                    'max_frames': self.max_frames}
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def _update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _writer_loop(self):
+        logger.info("DICOM writer thread started...")
+        unsynced = []  # (job id, path) written but not yet fsynced
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            job_id, saves = item
+            self._update(job_id, status='writing')
+            filenames = []
+            try:
+                for save, args, kwargs in saves:
+                    filename = save(*args, **kwargs)
+                    filenames.append(filename)
+                    unsynced.append((job_id, os.path.join(self.handler.storage_folder, filename)))
+                    self._update(job_id, filenames=list(filenames))
+                    if len(unsynced) >= self.fsync_batch:
+                        self._sync(unsynced)
+                        unsynced = []
+                self._finish(job_id, status='done', filename=filenames[0])
+            except Exception as e:
+                self._finish(job_id, status='error', error=str(e))
+
+            if self.queue.empty():
+                self._sync(unsynced)
+                unsynced = []
+        self._sync(unsynced)
+
+    def _sync(self, written):
+        if not written:
+            return
+        for job_id, path in written:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                with self.lock:
+                    job = self.jobs.get(job_id)
+                    if job is not None:
+                        job['synced_files'] += 1
+            except OSError as e:
+                logger.error("Error syncing %s: %s", path, e)
+        # Make the new directory entries durable too
+        for directory in {os.path.dirname(path) for _, path in written}:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.warning("Could not sync %s: %s", directory, e)
@@ -0,0 +1,184 @@
+import cv2
+import threading
+import numpy as np
+import logging
+from collections import namedtuple
+
+from config import DETECTION_DOWNSCALE
+
+logger = logging.getLogger(__name__)
+
+# downscale < 1 searches a smaller pyramid level and maps hits back to full
+# resolution; refine re-runs the cascade in a small full-res ROI around each hit;
+# track follows faces between detections with FaceTracker
+HaarPreset = namedtuple('HaarPreset', ['cascade', 'scale_factor', 'min_neighbors', 'min_size', 'downscale', 'refine', 'track'],
+                        defaults=(1.0, False, False))
+
+FRONTAL_FACE = 'haarcascade_frontalface_default.xml'
+
+HAAR_PRESETS = {
+    'haar_fast': HaarPreset(FRONTAL_FACE, 1.3, 3, (20, 20)),
+    'haar_balanced': HaarPreset(FRONTAL_FACE, 1.1, 5, (30, 30)),
+    'haar_accurate': HaarPreset(FRONTAL_FACE, 1.05, 7, (40, 40)),
+    'haar_multires': HaarPreset(FRONTAL_FACE, 1.1, 5, (30, 30), downscale=DETECTION_DOWNSCALE, refine=True),
+    'haar_tracking': HaarPreset(FRONTAL_FACE, 1.1, 5, (30, 30), track=True),
+}
+DEFAULT_PRESET = 'haar_balanced'
+
+class CascadeRegistry:
+    """
+    Loads each cascade XML once per thread and hands back the cached
+    classifier. OpenCV classifiers are not safe to share between threads,
+    so every thread that detects gets its own instance on first use.
+    """
+    def __init__(self, cascade_dir=None):
+        self.cascade_dir = cascade_dir if cascade_dir is not None else cv2.data.haarcascades
+        self.local = threading.local()
+
+    def get(self, name):
+        cache = getattr(self.local, 'cascades', None)
+        if cache is None:
+            cache = self.local.cascades = {}
+        cascade = cache.get(name)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(self.cascade_dir + name)
+            if cascade.empty():
+                logger.error(f"Failed to load cascade: {name}")
+                cascade = None
+            else:
+                logger.info(f"Loaded cascade {name} for thread {threading.current_thread().name}")
+            # Failed loads are cached too so a missing file isn't re-read every frame
+            cache[name] = cascade if cascade is not None else False
+        return cascade or None
+
+cascade_registry = CascadeRegistry()
+
+REFINE_PADDING = 0.25  # ROI padding around a coarse hit, as a fraction of its size
+
+def _refine_face(cascade, gray, rect, preset):
+    """Re-detect inside a padded full-res ROI around a coarse hit; keeps the coarse rect on a miss."""
+    x, y, w, h = rect
+    pad_x, pad_y = int(w * REFINE_PADDING), int(h * REFINE_PADDING)
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+    roi = gray[y0:y1, x0:x1]
+    if roi.size == 0:
+        return rect
+
+    # The face should fill most of the ROI, so only a narrow band of scales is searched
+    size = min(w, h)
+    min_size = (int(size * 0.7), int(size * 0.7))
+    max_size = (int(size * 1.4), int(size * 1.4))
+    hits = cascade.detectMultiScale(roi, scaleFactor=preset.scale_factor, minNeighbors=max(1, preset.min_neighbors - 2),
+                                    minSize=min_size, maxSize=max_size)
+    if len(hits) == 0:
+        return rect
+    rx, ry, rw, rh = max(hits, key=lambda r: r[2] * r[3])
+    return (int(x0 + rx), int(y0 + ry), int(rw), int(rh))
+
+def _detect_multires(cascade, gray, preset):
+    small = cv2.resize(gray, None, fx=preset.downscale, fy=preset.downscale, interpolation=cv2.INTER_AREA)
+    min_size = (max(1, int(preset.min_size[0] * preset.downscale)), max(1, int(preset.min_size[1] * preset.downscale)))
+    faces = cascade.detectMultiScale(small, scaleFactor=preset.scale_factor,
+                                     minNeighbors=preset.min_neighbors, minSize=min_size)
+
+    inv = 1.0 / preset.downscale
+    rects = [(int(x * inv), int(y * inv), int(w * inv), int(h * inv)) for (x, y, w, h) in faces]
+    if preset.refine:
+        rects = [_refine_face(cascade, gray, rect, preset) for rect in rects]
+    return rects
+
+def detect_faces(frame, mode=DEFAULT_PRESET):
+    try:
+        preset = HAAR_PRESETS.get(mode, HAAR_PRESETS[DEFAULT_PRESET])
+        face_cascade = cascade_registry.get(preset.cascade)
+        if face_cascade is None:
+            return []
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if preset.downscale < 1.0:
+            return _detect_multires(face_cascade, gray, preset)
+
+        faces = face_cascade.detectMultiScale(gray, scaleFactor=preset.scale_factor,
+                                              minNeighbors=preset.min_neighbors, minSize=preset.min_size)
+        return [(x, y, w, h) for (x, y, w, h) in faces]
+    except Exception as e:
+        logger.error("Error in face detection: %s", e)
+        return []
+
+class FaceTracker:
+    """
+    Moves face boxes between detections with sparse Lucas-Kanade optical
+    flow on corner features inside each box. Each box is shifted by the
+    median motion of its surviving points. `confidence` is the fraction of
+    the seeded points still tracked; callers should re-detect when it drops.
+
+    reset() must be given the gray image the boxes were detected on, which
+    may be several frames old; update() then carries them forward to the
+    current frame. Features are only seeded in the central part of each box
+    (`inset` trimmed from every side) so background corners at the box
+    edges don't drag it around. A face too flat to seed `min_points`
+    features is kept as a static box until the next reset().
+    """
+    def __init__(self, max_corners=30, min_points=4, inset=0.15):
+        self.max_corners = max_corners
+        self.min_points = min_points
+        self.inset = inset
+        self.prev_gray = None
+        self.tracks = []  # [[x, y, w, h], points(N, 1, 2)]
+        self.static = []  # (x, y, w, h) detections with too few features to track
+        self.seeded_points = 0
+        self.confidence = 0.0
+        self.source_seq = 0
+
+    def reset(self, gray, faces, source_seq):
+        self.prev_gray = gray
+        self.source_seq = source_seq
+        self.tracks = []
+        self.static = []
+        for (x, y, w, h) in faces:
+            dx, dy = int(w * self.inset), int(h * self.inset)
+            x0, y0 = max(0, x + dx), max(0, y + dy)
+            x1, y1 = x + w - dx, y + h - dy
+            points = None
+            if x1 > x0 and y1 > y0:
+                points = cv2.goodFeaturesToTrack(gray[y0:y1, x0:x1], self.max_corners, 0.01, 5)
+            if points is None or len(points) < self.min_points:
+                self.static.append((x, y, w, h))
+                continue
+            points = points + np.array([x0, y0], dtype=np.float32)
+            self.tracks.append([[x, y, w, h], points])
+        self.seeded_points = sum(len(points) for _, points in self.tracks)
+        self.confidence = 1.0 if self.tracks else 0.0
+        return self.boxes()
+
+    def update(self, gray):
+        if not self.tracks or self.prev_gray is None:
+            self.prev_gray = gray
+            self.confidence = 0.0
+            return self.boxes()
+
+        old = np.concatenate([points for _, points in self.tracks])
+        new, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, old, None, winSize=(15, 15), maxLevel=2)
+        status = status.reshape(-1).astype(bool)
+
+        tracks = []
+        start = 0
+        for rect, points in self.tracks:
+            end = start + len(points)
+            good = status[start:end]
+            if good.sum() >= self.min_points:
+                moved = new[start:end][good]
+                dx, dy = np.median((moved - points[good]).reshape(-1, 2), axis=0)
+                rect = [int(round(rect[0] + dx)), int(round(rect[1] + dy)), rect[2], rect[3]]
+                tracks.append([rect, moved])
+            start = end
+
+        self.tracks = tracks
+        self.prev_gray = gray
+        tracked = sum(len(points) for _, points in tracks)
+        self.confidence = tracked / self.seeded_points if self.seeded_points else 0.0
+        return self.boxes()
+
+    def boxes(self):
+        return [tuple(rect) for rect, _ in self.tracks] + self.static
@@ -0,0 +1,97 @@
+import time
+import random
+import bisect
+import logging
+import threading
+from collections import defaultdict
+
+from config import METRICS_FLUSH_INTERVAL, METRICS_DEBUG_SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)  # Upper bounds; a final overflow bucket is implied
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts)),
+        }
+
+class FrameMetrics:
+    """
+    In-memory counters and histograms for the per-frame detection path.
+    Values are aggregated and written to the log once per `flush_interval`
+    seconds instead of one log line per frame. sample() gates per-frame
+    debug logging to roughly `debug_sample_rate` of calls.
+    """
+    def __init__(self, flush_interval=METRICS_FLUSH_INTERVAL, debug_sample_rate=METRICS_DEBUG_SAMPLE_RATE):
+        self.flush_interval = flush_interval
+        self.debug_sample_rate = debug_sample_rate
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self.window_start = time.monotonic()
+        self.last_window = {}  # Snapshot of the previous flushed window
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def sample(self):
+        """True for about `debug_sample_rate` of calls, and never when debug logging is off."""
+        return logger.isEnabledFor(logging.DEBUG) and random.random() < self.debug_sample_rate
+
+    def maybe_flush(self):
+        if time.monotonic() - self.window_start >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            now = time.monotonic()
+            window = self._snapshot(now - self.window_start)
+            self.counters = defaultdict(int)
+            self.histograms = defaultdict(Histogram)
+            self.window_start = now
+            self.last_window = window
+        if window['counters'] or window['histograms']:
+            logger.info("Frame metrics over %.1fs: counters=%s histograms=%s",
+                        window['seconds'], window['counters'], window['histograms'])
+        return window
+
+    def snapshot(self):
+        """Current (unflushed) window plus the last flushed one."""
+        with self.lock:
+            current = self._snapshot(time.monotonic() - self.window_start)
+            return {'current': current, 'previous': self.last_window}
+
+    def _snapshot(self, seconds):
+        return {
+            'seconds': seconds,
+            'counters': dict(self.counters),
+            'histograms': {name: h.summary() for name, h in self.histograms.items()},
+        }
+
+frame_metrics = FrameMetrics()
@@ -1,48 +1,139 @@
-import time
 import threading
 import logging
 
+from step_backends import create_backend
+
 logger = logging.getLogger(__name__)
 
+AXIS_PINS = {'m1': ('DIR1', 'STEP1'), 'm2': ('DIR2', 'STEP2')}
+
+class MotionPlanner:
+    """
+    Per-step timing for a move. The acceleration ramp, one step interval per
+    step from `min_rate` up to `max_rate` (steps/s), is computed once. A
+    move of n steps uses interval[i] = ramp[min(i, n - 1 - i)], so it speeds
+    up along the ramp, cruises, and mirrors the ramp to stop. Short moves
+    never reach cruise speed and simply peak midway.
+
+    With `jerk` set, acceleration itself builds up and tapers off at that
+    rate (an S-curve). With jerk=0 the profile is trapezoidal. `min_rate`
+    is the speed the motors can start and stop at without stalling.
+    """
+    def __init__(self, min_rate, max_rate, acceleration=0, jerk=0):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.acceleration = acceleration
+        self.jerk = jerk
+        self.ramp = self._build_ramp()
+
+    def indices(self, steps, start=0):
+        """
+        Ramp index of each step of a `steps`-step move. `start` is the ramp
+        index the motors are already moving at, so a retargeted move
+        continues at its current speed. It must be at most `steps`, or the
+        move couldn't slow down in time.
+        """
+        last = len(self.ramp) - 1
+        return [min(start + i, steps - 1 - i, last) for i in range(steps)]
+
+    def brake_indices(self, speed):
+        """Ramp indices that bring a move at ramp index `speed` down to the start rate."""
+        return list(range(speed - 1, -1, -1))
+
+    def intervals(self, steps, start=0):
+        """Step intervals in seconds for a move of `steps` steps; see indices()."""
+        return [self.ramp[i] for i in self.indices(steps, start)]
+
+    def rate(self, index):
+        return 1.0 / self.ramp[index]
+
+    def move_time(self, steps):
+        return sum(self.intervals(steps))
+
+    def _build_ramp(self):
+        if not self.acceleration or self.max_rate <= self.min_rate:
+            return [1.0 / self.min_rate]
+        ramp = []
+        rate = self.min_rate
+        accel = self.acceleration if not self.jerk else 0.0
+        while rate < self.max_rate:
+            dt = 1.0 / rate
+            ramp.append(dt)
+            if self.jerk:
+                # Taper acceleration so it reaches zero just as cruise speed is reached
+                if self.max_rate - rate <= accel * accel / (2 * self.jerk):
+                    accel = max(accel - self.jerk * dt, 0.05 * self.acceleration)
+                else:
+                    accel = min(accel + self.jerk * dt, self.acceleration)
+            rate = min(rate + accel * dt, self.max_rate)
+        ramp.append(1.0 / self.max_rate)
+        return ramp
+
 class MotorController:
-    def __init__(self, pins, deg_per_step_m1, deg_per_step_m2, step_delay):
+    def __init__(self, pins, deg_per_step_m1, deg_per_step_m2, step_delay, planner=None, backend=None,
+                 chunk_time=0.02):
         self.pins = pins
         self.deg_per_step = {'m1': deg_per_step_m1, 'm2': deg_per_step_m2}
         self.step_delay = step_delay
+        # Without a planner every step takes 2 * step_delay, as before
+        self.planner = planner or MotionPlanner(1.0 / (2 * step_delay), 1.0 / (2 * step_delay))
+        self.chunk_time = chunk_time  # Seconds of steps handed to the backend at once
         self.state = {
             'm1_pending': 0, 'm1_pos': 0,
             'm2_pending': 0, 'm2_pos': 0,
             'running': True
         }
         self.target_steps = {'m1': 0, 'm2': 0}  # Store target positions in steps
+        self.generation = 0  # Bumped by every command; the control loop replans when it changes
         self.lock = threading.Lock()
+        # Signalled on every command and whenever the control loop goes idle
+        self.work = threading.Condition(self.lock)
+        self.busy = False  # True while reserved steps are still being played
+        self.halt = False  # Set by emergency_stop/tare: the next plan ignores the current speed
+        self.stops = 0  # Emergency stops so far; sequences of moves (sweeps) end when it changes
+
+        # Pins are configured before the control thread can touch them
+        self.backend = backend or create_backend()
+        self.backend.setup(self.pins)
+        logger.info("Step backend: %s", self.backend.name)
+
         self.thread = threading.Thread(target=self._control_loop)
         self.thread.start()
 
-        # GPIO Setup
-        try:
-            import RPi.GPIO as GPIO
-            self.gpio_available = True
-            GPIO.setmode(GPIO.BCM)
-            for pin in self.pins.values():
-                GPIO.setup(pin, GPIO.OUT)
-            GPIO.output(self.pins['EN1'], GPIO.HIGH)
-            GPIO.output(self.pins['EN2'], GPIO.HIGH)
-        except ImportError:
-            logger.warning("RPi.GPIO not found. Running in simulation mode.")
-            self.gpio_available = False
-
     def move_motor(self, motor, direction, steps):
         with self.lock:
             if motor == 'm1':
                 self.state['m1_pending'] += steps if direction == 'forward' else -steps
             elif motor == 'm2':
                 self.state['m2_pending'] += steps if direction == 'forward' else -steps
+            self._notify_command()
 
     def set_target_angle(self, motor, angle):
         self.target_steps[motor] = round(angle / self.deg_per_step[motor])
         with self.lock:
             self.state[f'{motor}_pending'] = self.target_steps[motor] - self.state[f'{motor}_pos']
+            self._notify_command()
+
+    def move_to(self, angles, stops):
+        """
+        Set target angles for several motors at once, unless emergency_stop()
+        was called since `stops` was read. Returns False without moving if
+        it was, so a multi-step sequence can't resume after an E-stop.
+        """
+        with self.lock:
+            if self.stops != stops:
+                return False
+            for motor, angle in angles.items():
+                self.target_steps[motor] = round(angle / self.deg_per_step[motor])
+                self.state[f'{motor}_pending'] = self.target_steps[motor] - self.state[f'{motor}_pos']
+            self._notify_command()
+            return True
+
+    def at_target(self, motors):
+        """True if every motor in `motors` is at rest on its target position."""
+        with self.lock:
+            return (not self._moving()
+                    and all(self.state[f'{motor}_pos'] == self.target_steps[motor] for motor in motors))
 
     def reset_angles(self):
         self.target_steps['m1'] = 0
@@ -50,13 +141,19 @@ class MotorController:
         with self.lock:
             self.state['m1_pending'] = -self.state['m1_pos']
             self.state['m2_pending'] = -self.state['m2_pos']
+            self._notify_command()
 
     def tare_position(self):
-        with self.lock:
-            self.state['m1_pos'] = 0
-            self.state['m2_pos'] = 0
+        with self.work:
             self.state['m1_pending'] = 0
             self.state['m2_pending'] = 0
+            self.halt = True
+            self._notify_command()
+            # Positions already count the chunk being pulsed; zero them only
+            # once it has gone out, or the new zero is off by that chunk
+            self.work.wait_for(lambda: not self.busy or not self.state['running'])
+            self.state['m1_pos'] = 0
+            self.state['m2_pos'] = 0
         self.target_steps['m1'] = 0
         self.target_steps['m2'] = 0
 
@@ -64,6 +161,10 @@ class MotorController:
         with self.lock:
             self.state['m1_pending'] = 0
             self.state['m2_pending'] = 0
+            # Stop dead instead of braking along the ramp
+            self.halt = True
+            self.stops += 1
+            self._notify_command()
 
     def get_positions(self):
         with self.lock:
@@ -72,55 +173,183 @@ class MotorController:
                 'm2': self.state['m2_pos'] * self.deg_per_step['m2']
             }
 
+    def is_moving(self):
+        with self.lock:
+            return self._moving()
+
+    def wait_until_idle(self, timeout=None):
+        """Block until both motors have stopped. Returns False on timeout."""
+        with self.work:
+            return self.work.wait_for(lambda: not self._moving(), timeout)
+
     def get_targets(self):
         return {
             'm1': self.target_steps['m1'] * self.deg_per_step['m1'],
             'm2': self.target_steps['m2'] * self.deg_per_step['m2']
         }
 
+    def get_stats(self):
+        """Backend timing stats (e.g. measured jitter for the simulated backend)."""
+        return self.backend.get_stats()
+
     def stop(self):
-        self.state['running'] = False
+        with self.work:
+            self.state['running'] = False
+            self.work.notify_all()
         self.thread.join()
-        if self.gpio_available:
-            import RPi.GPIO as GPIO
-            GPIO.cleanup()
-
-    def _set_direction(self, dir_pin, direction):
-        if not self.gpio_available:
-            return
-        import RPi.GPIO as GPIO
-        GPIO.output(dir_pin, GPIO.HIGH if direction > 0 else GPIO.LOW)
-
-    def _step_pin_pulse(self, step_pin):
-        if not self.gpio_available:
-            time.sleep(self.step_delay * 2)
-            return
-        import RPi.GPIO as GPIO
-        GPIO.output(step_pin, GPIO.HIGH)
-        time.sleep(self.step_delay)
-        GPIO.output(step_pin, GPIO.LOW)
-        time.sleep(self.step_delay)
+        self.backend.cleanup()
+
+    def _notify_command(self):
+        """Tell the control loop to replan. Caller holds the lock."""
+        self.generation += 1
+        self.work.notify_all()
+
+    def _moving(self):
+        """Caller holds the lock."""
+        return self.busy or self.state['m1_pending'] != 0 or self.state['m2_pending'] != 0
+
+    def _plan_move(self, previous=None):
+        """
+        Plan a straight-line move from the pending step counts. The axis with
+        more steps (the major axis) steps on every tick. The other axis uses
+        a Bresenham error term to step on an evenly spread subset of ticks.
+        The move therefore takes max(|m1|, |m2|) ticks instead of their sum.
+        Tick intervals come from the motion planner.
+
+        If `previous` is still moving, the new plan only continues at its
+        speed when no axis' step rate would jump by more than the start
+        rate, the major axis is unchanged, and the new move is long enough
+        to slow down in. Otherwise the current motion is braked to the start
+        rate first, overshooting if needed. The move is then replanned from
+        rest once the brake finishes. Caller holds the lock.
+        """
+        axes = {}
+        for motor in AXIS_PINS:
+            pending = self.state[f'{motor}_pending']
+            if pending:
+                axes[motor] = {'dir': 1 if pending > 0 else -1, 'steps': abs(pending)}
+        total = max((axis['steps'] for axis in axes.values()), default=0)
+        for axis in axes.values():
+            axis['error'] = total // 2
+
+        speed = self._plan_speed(previous)
+        if speed and not self._can_continue(previous, axes, total, speed):
+            return self._build_plan(previous['axes'], previous['span'], self.planner.brake_indices(speed), speed)
+        return self._build_plan(axes, total, self.planner.indices(total, speed), speed)
+
+    def _build_plan(self, axes, span, indices, entry_speed):
+        """`span` is the Bresenham denominator: the major axis' step count for the straight line."""
+        return {'axes': axes, 'span': span, 'total': len(indices), 'tick': 0, 'entry_speed': entry_speed,
+                'indices': indices, 'intervals': [self.planner.ramp[i] for i in indices]}
+
+    def _plan_speed(self, plan):
+        """Ramp index the motors are moving at under `plan`; 0 means at rest or at the start rate."""
+        if plan is None:
+            return 0
+        if plan['tick'] == 0:
+            return plan['entry_speed']
+        return plan['indices'][plan['tick'] - 1]
+
+    def _can_continue(self, previous, axes, total, speed):
+        if total < speed:
+            return False
+        if not self._major_axes(axes, total) & self._major_axes(previous['axes'], previous['span']):
+            return False
+        rate = self.planner.rate(speed)
+        for motor in AXIS_PINS:
+            before = self._axis_rate(previous['axes'].get(motor), previous['span'], rate)
+            after = self._axis_rate(axes.get(motor), total, rate)
+            if abs(after - before) > self.planner.min_rate:
+                return False
+        return True
+
+    def _major_axes(self, axes, span):
+        return {motor for motor, axis in axes.items() if axis['steps'] == span}
+
+    def _axis_rate(self, axis, span, tick_rate):
+        """Signed steps/s of one axis at a given tick rate."""
+        if axis is None:
+            return 0.0
+        return axis['dir'] * tick_rate * axis['steps'] / span
+
+    def _next_tick(self, plan):
+        """(motors, interval) for the plan's next tick, or ([], None) once it's done."""
+        if plan['tick'] >= plan['total']:
+            return [], None
+        interval = plan['intervals'][plan['tick']]
+        plan['tick'] += 1
+        stepping = []
+        for motor, axis in plan['axes'].items():
+            axis['error'] += axis['steps']
+            if axis['error'] >= plan['span']:
+                axis['error'] -= plan['span']
+                stepping.append(motor)
+        return stepping, interval
+
+    def _reserve_ticks(self, plan, max_duration):
+        """
+        Take ticks from `plan` until they add up to `max_duration` seconds,
+        updating pos/pending as if they had already run. Returns a list of
+        (step pins, interval). Caller holds the lock.
+        """
+        ticks = []
+        duration = 0.0
+        while duration < max_duration:
+            stepping, interval = self._next_tick(plan)
+            if not stepping:
+                break
+            for motor in stepping:
+                direction = plan['axes'][motor]['dir']
+                self.state[f'{motor}_pending'] -= direction
+                self.state[f'{motor}_pos'] += direction
+            ticks.append(([self.pins[AXIS_PINS[motor][1]] for motor in stepping], interval))
+            duration += interval
+        return ticks
 
     def _control_loop(self):
         logger.info("Motor control thread started...")
+        plan = None
+        plan_generation = None
+        pin_directions = {}  # DIR pin -> last direction written
         while self.state['running']:
-            moved = False
+            directions = None
+            # Only bookkeeping happens under the lock: the next chunk of
+            # ticks is reserved (pos/pending updated up front) and handed to
+            # the backend afterwards, so commands and get_positions() never
+            # wait behind step pulses. Positions lead the hardware by at
+            # most the chunk in flight, and a new command takes effect at
+            # the next chunk boundary.
             with self.lock:
-                # Motor 1
-                if self.state['m1_pending'] != 0:
-                    direction = 1 if self.state['m1_pending'] > 0 else -1
-                    self._set_direction(self.pins['DIR1'], direction)
-                    self._step_pin_pulse(self.pins['STEP1'])
-                    self.state['m1_pending'] -= direction
-                    self.state['m1_pos'] += direction
-                    moved = True
-                # Motor 2
-                if self.state['m2_pending'] != 0:
-                    direction = 1 if self.state['m2_pending'] > 0 else -1
-                    self._set_direction(self.pins['DIR2'], direction)
-                    self._step_pin_pulse(self.pins['STEP2'])
-                    self.state['m2_pending'] -= direction
-                    self.state['m2_pos'] += direction
-                    moved = True
-            if not moved:
-                time.sleep(0.01)
\ No newline at end of file
+                if plan is None or plan_generation != self.generation:
+                    # New command: replan from wherever the motors are now
+                    plan = self._plan_move(None if self.halt else plan)
+                    plan_generation = self.generation
+                    self.halt = False
+                    # Only write pins that change: a DIR write makes the
+                    # pigpio backend wait for queued pulses to finish
+                    directions = []
+                    for motor, axis in plan['axes'].items():
+                        dir_pin = self.pins[AXIS_PINS[motor][0]]
+                        if pin_directions.get(dir_pin) != axis['dir']:
+                            pin_directions[dir_pin] = axis['dir']
+                            directions.append((dir_pin, axis['dir']))
+                ticks = self._reserve_ticks(plan, self.chunk_time)
+                if not ticks:
+                    if any(self.state[f'{motor}_pending'] for motor in AXIS_PINS):
+                        # Plan finished with steps left over; pick them up next pass
+                        plan = None
+                        continue
+                    # Idle: sleep until a command arrives, without polling
+                    self.busy = False
+                    self.work.notify_all()
+                    self.work.wait_for(lambda: self.generation != plan_generation or not self.state['running'])
+                    continue
+                self.busy = True
+
+            if directions:
+                for dir_pin, direction in directions:
+                    self.backend.set_direction(dir_pin, direction)
+            self.backend.play(ticks)
+            if plan['tick'] >= plan['total']:
+                # Let the last steps finish before the loop reports idle
+                self.backend.flush()
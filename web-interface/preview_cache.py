@@ -0,0 +1,127 @@
+import os
+import re
+import cv2
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+UID_PATTERN = re.compile(r'^[0-9.]{1,64}$')
+
+PREVIEW_SIZES = OrderedDict([  # Longest side in pixels, largest first
+    ('preview', 640),
+    ('thumbnail', 160),
+])
+
+class PreviewCache:
+    """
+    On-disk JPEG previews of saved captures, keyed by SOPInstanceUID and
+    sharded by the UID's last two digits. Previews are normally written at
+    save time; a missing one is generated on first request. Once written, a
+    preview is served as a static file.
+
+    The cache is bounded by `max_bytes`: the least recently served previews
+    are deleted first. Recency is tracked in memory and seeded from file
+    modification times at startup.
+    """
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, quality=80):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> size, least recently used first
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'written': 0, 'evicted': 0}
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        self._load()
+
+    def path(self, sop_instance_uid, kind='thumbnail'):
+        if not UID_PATTERN.match(sop_instance_uid) or kind not in PREVIEW_SIZES:
+            raise ValueError("Invalid preview request")
+        shard = sop_instance_uid.replace('.', '')[-2:]
+        return os.path.join(self.cache_dir, shard, f"{sop_instance_uid}_{kind}.jpg")
+
+    def get(self, sop_instance_uid, load_image, kind='thumbnail'):
+        """
+        Return the path of a cached preview, creating it first if needed.
+        `load_image()` is only called on a miss and must return an RGB array.
+        """
+        path = self.path(sop_instance_uid, kind)
+        with self.lock:
+            if path in self.entries:
+                self.entries.move_to_end(path)
+                self.stats['hits'] += 1
+                return path
+            self.stats['misses'] += 1
+        self.write(sop_instance_uid, load_image(), kind)
+        return path
+
+    def write_all(self, sop_instance_uid, image_rgb):
+        """Write every preview size for a capture, each downscaled from the previous one."""
+        image = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+        for kind in PREVIEW_SIZES:
+            image = self._write(sop_instance_uid, image, kind)
+
+    def write(self, sop_instance_uid, image_rgb, kind='thumbnail'):
+        self._write(sop_instance_uid, cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR), kind)
+        return self.path(sop_instance_uid, kind)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.total_bytes, max_bytes=self.max_bytes)
+
+    def _write(self, sop_instance_uid, image, kind):
+        """Downscale a BGR image to `kind`, store it, and return the downscaled image."""
+        path = self.path(sop_instance_uid, kind)
+        height, width = image.shape[:2]
+        scale = PREVIEW_SIZES[kind] / max(height, width)
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("Preview encoding failed")
+
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Write then rename so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes += len(buffer) - self.entries.pop(path, 0)
+            self.entries[path] = len(buffer)
+            self.stats['written'] += 1
+            self._evict()
+        return image
+
+    def _evict(self):
+        """Delete least recently used previews until the cache fits. Caller holds the lock."""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.stats['evicted'] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _load(self):
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    # Left over from an interrupted write
+                    os.remove(path)
+                    continue
+                st = os.stat(path)
+                found.append((st.st_mtime, path, st.st_size))
+        for _, path, size in sorted(found):
+            self.entries[path] = size
+            self.total_bytes += size
+        with self.lock:
+            self._evict()
+        if found:
+            logger.info("Preview cache: %d files, %.1f MB", len(self.entries), self.total_bytes / 1e6)
@@ -0,0 +1,184 @@
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+class SimulatedBackend:
+    """
+    Off-Pi backend. Plays step trains with the same deadline-based sleeps as
+    RPiGPIOBackend and records when each tick actually fired, so timing
+    jitter can be measured without hardware.
+    """
+    name = 'simulated'
+
+    def __init__(self, history=10000):
+        self.ticks = deque(maxlen=history)  # (timestamp, step_pins, scheduled interval)
+        self.directions = {}
+        self.jitter = deque(maxlen=history)  # Seconds each tick fired after its deadline
+
+    def setup(self, pins):
+        pass
+
+    def set_direction(self, dir_pin, direction):
+        self.directions[dir_pin] = direction
+
+    def play(self, ticks):
+        deadline = time.perf_counter()
+        for step_pins, interval in ticks:
+            now = time.perf_counter()
+            self.jitter.append(max(now - deadline, 0.0))
+            self.ticks.append((now, step_pins, interval))
+            deadline += interval
+            _sleep_until(deadline)
+
+    def flush(self):
+        """Block until every queued step has been output."""
+
+    def cleanup(self):
+        pass
+
+    def get_stats(self):
+        jitter = sorted(self.jitter)
+        if not jitter:
+            return {'backend': self.name, 'ticks': 0}
+        return {'backend': self.name, 'ticks': len(jitter),
+                'jitter_avg_us': 1e6 * sum(jitter) / len(jitter),
+                'jitter_p99_us': 1e6 * jitter[int(len(jitter) * 0.99)],
+                'jitter_max_us': 1e6 * jitter[-1]}
+
+class RPiGPIOBackend:
+    """
+    Software-timed pulses through RPi.GPIO. The timing is only as steady as
+    the Python thread's scheduling. Each tick is aimed at an absolute
+    deadline, so a late tick doesn't push back the ticks after it.
+    """
+    name = 'rpi_gpio'
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+
+    def setup(self, pins):
+        GPIO = self.GPIO
+        GPIO.setmode(GPIO.BCM)
+        for pin in pins.values():
+            GPIO.setup(pin, GPIO.OUT)
+        GPIO.output(pins['EN1'], GPIO.HIGH)
+        GPIO.output(pins['EN2'], GPIO.HIGH)
+
+    def set_direction(self, dir_pin, direction):
+        self.GPIO.output(dir_pin, self.GPIO.HIGH if direction > 0 else self.GPIO.LOW)
+
+    def play(self, ticks):
+        GPIO = self.GPIO
+        deadline = time.perf_counter()
+        for step_pins, interval in ticks:
+            GPIO.output(step_pins, GPIO.HIGH)
+            _sleep_until(deadline + interval / 2)
+            GPIO.output(step_pins, GPIO.LOW)
+            deadline += interval
+            _sleep_until(deadline)
+
+    def flush(self):
+        pass
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+class PigpioBackend:
+    """
+    Hardware-timed pulses through the pigpio daemon. Each step train becomes
+    a waveform that pigpio clocks out by DMA, so the Python process being
+    busy doesn't disturb step timing. A new train is queued to start when
+    the current one ends (WAVE_MODE_ONE_SHOT_SYNC). play() returns while it
+    is still running, so the next train is built during playback and motion
+    has no gaps between chunks.
+    """
+    name = 'pigpio'
+
+    def __init__(self):
+        import pigpio
+        self.pigpio = pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("pigpio daemon not running")
+        self.waves = deque()  # Wave ids queued or playing, oldest first
+
+    def setup(self, pins):
+        for pin in pins.values():
+            self.pi.set_mode(pin, self.pigpio.OUTPUT)
+        self.pi.write(pins['EN1'], 1)
+        self.pi.write(pins['EN2'], 1)
+        self.pi.wave_clear()
+
+    def set_direction(self, dir_pin, direction):
+        # Flipping DIR while a queued train is still playing would corrupt it
+        self._drain()
+        self.pi.write(dir_pin, 1 if direction > 0 else 0)
+
+    def play(self, ticks):
+        pulses = []
+        for step_pins, interval in ticks:
+            mask = 0
+            for pin in step_pins:
+                mask |= 1 << pin
+            half = max(int(interval * 1e6 / 2), 1)
+            pulses.append(self.pigpio.pulse(mask, 0, half))
+            pulses.append(self.pigpio.pulse(0, mask, half))
+        self.pi.wave_add_generic(pulses)
+        wave_id = self.pi.wave_create()
+        self.pi.wave_send_using_mode(wave_id, self.pigpio.WAVE_MODE_ONE_SHOT_SYNC)
+        self.waves.append(wave_id)
+        # Keep at most one train queued behind the one playing
+        while len(self.waves) > 1:
+            if self.pi.wave_tx_at() == self.waves[0]:
+                time.sleep(0.001)
+                continue
+            self.pi.wave_delete(self.waves.popleft())
+
+    def flush(self):
+        self._drain()
+
+    def cleanup(self):
+        self._drain()
+        self.pi.wave_clear()
+        self.pi.stop()
+
+    def get_stats(self):
+        return {'backend': self.name, 'queued_waves': len(self.waves)}
+
+    def _drain(self):
+        while self.waves and self.pi.wave_tx_busy():
+            time.sleep(0.001)
+        while self.waves:
+            self.pi.wave_delete(self.waves.popleft())
+
+STEP_BACKENDS = {
+    'simulated': SimulatedBackend,
+    'rpi_gpio': RPiGPIOBackend,
+    'pigpio': PigpioBackend,
+}
+
+def create_backend(name='auto'):
+    """
+    Instantiate a step backend by name. 'auto' prefers pigpio, then RPi.GPIO,
+    and falls back to simulation when neither is usable.
+    """
+    if name != 'auto':
+        return STEP_BACKENDS[name]()
+    for candidate in ('pigpio', 'rpi_gpio'):
+        try:
+            return STEP_BACKENDS[candidate]()
+        except (ImportError, RuntimeError) as e:
+            logger.debug("Step backend %s unavailable: %s", candidate, e)
+    logger.warning("No GPIO backend found. Running in simulation mode.")
+    return SimulatedBackend()
+
+def _sleep_until(deadline):
+    remaining = deadline - time.perf_counter()
+    if remaining > 0:
+        time.sleep(remaining)
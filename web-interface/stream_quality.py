@@ -0,0 +1,129 @@
+import time
+import threading
+import logging
+from collections import namedtuple
+
+from config import STREAM_TARGET_LATENCY
+
+logger = logging.getLogger(__name__)
+
+StreamSettings = namedtuple('StreamSettings', ['quality', 'scale', 'skip'])
+
+# Ordered from best to cheapest. Quality drops first, then resolution, and
+# frame skipping is the last resort.
+QUALITY_LADDER = [
+    StreamSettings(80, 1.0, 1),
+    StreamSettings(70, 1.0, 1),
+    StreamSettings(60, 1.0, 1),
+    StreamSettings(50, 0.75, 1),
+    StreamSettings(40, 0.5, 1),
+    StreamSettings(40, 0.5, 2),
+    StreamSettings(30, 0.5, 3),
+]
+DEFAULT_LEVEL = 1  # Matches the old fixed quality of 70 at full resolution
+
+class AdaptiveStreamController:
+    """
+    Per-client MJPEG quality controller. The stream generator reports how
+    long each chunk took to drain into the client's socket; when the
+    smoothed drain time exceeds the latency target the client moves down
+    QUALITY_LADDER, and after a sustained period well under target it moves
+    back up.
+    """
+    def __init__(self, client_id, target_latency=STREAM_TARGET_LATENCY, level=DEFAULT_LEVEL,
+                 smoothing=0.3, hold_time=1.0, upgrade_time=5.0):
+        self.client_id = client_id
+        self.target_latency = target_latency
+        self.level = level
+        self.smoothing = smoothing
+        self.hold_time = hold_time  # Minimum seconds between any two changes
+        self.upgrade_time = upgrade_time  # Seconds under half the target before stepping up
+        self.drain_time = 0.0  # Smoothed seconds per chunk
+        self.throughput = 0.0  # Smoothed bytes per second
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.skip_count = 0
+        self.connected_at = time.time()
+        self.last_change = time.monotonic()
+        self.good_since = None
+
+    @property
+    def settings(self):
+        return QUALITY_LADDER[self.level]
+
+    def should_send(self):
+        """Apply the frame-skip setting: send one frame out of every `skip`."""
+        self.skip_count += 1
+        if self.skip_count < self.settings.skip:
+            self.frames_skipped += 1
+            return False
+        self.skip_count = 0
+        return True
+
+    def record(self, drain_time, size):
+        self.frames_sent += 1
+        alpha = self.smoothing
+        self.drain_time = drain_time if self.frames_sent == 1 else alpha * drain_time + (1 - alpha) * self.drain_time
+        if drain_time > 0:
+            self.throughput = alpha * (size / drain_time) + (1 - alpha) * self.throughput
+        self._adjust()
+
+    def _adjust(self):
+        now = time.monotonic()
+        if now - self.last_change < self.hold_time:
+            return
+
+        if self.drain_time > self.target_latency:
+            self.good_since = None
+            if self.level < len(QUALITY_LADDER) - 1:
+                self._set_level(self.level + 1, now)
+        elif self.drain_time < self.target_latency / 2:
+            if self.good_since is None:
+                self.good_since = now
+            elif now - self.good_since >= self.upgrade_time and self.level > 0:
+                self.good_since = None
+                self._set_level(self.level - 1, now)
+        else:
+            self.good_since = None
+
+    def _set_level(self, level, now):
+        logger.info("Stream %s: level %d -> %d (drain %.0f ms, target %.0f ms)", self.client_id,
+                    self.level, level, self.drain_time * 1000, self.target_latency * 1000)
+        self.level = level
+        self.last_change = now
+
+    def get_stats(self):
+        return {
+            'client': self.client_id,
+            'quality': self.settings.quality,
+            'scale': self.settings.scale,
+            'skip': self.settings.skip,
+            'level': self.level,
+            'drain_ms': self.drain_time * 1000,
+            'throughput_kbps': self.throughput * 8 / 1000,
+            'frames_sent': self.frames_sent,
+            'frames_skipped': self.frames_skipped,
+            'connected_for': time.time() - self.connected_at,
+        }
+
+class StreamClients:
+    """Registry of the controllers for currently connected /video_feed clients."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.next_id = 0
+
+    def register(self, address):
+        with self.lock:
+            self.next_id += 1
+            controller = AdaptiveStreamController(f"{address}#{self.next_id}")
+            self.clients[controller.client_id] = controller
+        return controller
+
+    def unregister(self, controller):
+        with self.lock:
+            self.clients.pop(controller.client_id, None)
+
+    def get_stats(self):
+        with self.lock:
+            return [c.get_stats() for c in self.clients.values()]
@@ -0,0 +1,89 @@
+import cv2
+import numpy as np
+import pytest
+
+from anomaly_detection import (MAX_ANOMALIES, MAX_AREA, MIN_AREA, MIN_CIRCULARITY,
+                               _find_white_patches, detect_skin_anomalies)
+
+def contour_patches(image, min_area=MIN_AREA, max_area=MAX_AREA):
+    """The original per-contour scan that _find_white_patches replaced."""
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    white_mask = cv2.inRange(hsv, (0, 0, 200), (180, 50, 255))
+    white_mask = cv2.morphologyEx(white_mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(white_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    patches = []
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < min_area or area > max_area:
+            continue
+        perimeter = cv2.arcLength(cnt, True)
+        if perimeter == 0:
+            continue
+        if 4 * np.pi * area / (perimeter * perimeter) < MIN_CIRCULARITY:
+            continue
+        (x, y), radius = cv2.minEnclosingCircle(cnt)
+        patches.append((int(x), int(y), int(radius), area))
+    return patches
+
+def fixture_frame(seed, blobs=150):
+    """Skin-toned frame with white dots, ellipses, bars and speckle of many sizes."""
+    rng = np.random.default_rng(seed)
+    frame = np.empty((480, 640, 3), np.uint8)
+    frame[:] = (120, 150, 200)
+    frame = cv2.add(frame, rng.integers(0, 30, frame.shape, dtype=np.uint8))
+    for _ in range(blobs):
+        center = (int(rng.integers(0, 640)), int(rng.integers(0, 480)))
+        colour = (255, 255, 255) if rng.random() < 0.8 else (80, 230, 250)  # Some bright but saturated
+        shape = rng.integers(3)
+        if shape == 0:
+            cv2.circle(frame, center, int(rng.integers(1, 25)), colour, -1)
+        elif shape == 1:
+            axes = (int(rng.integers(2, 30)), int(rng.integers(2, 30)))
+            cv2.ellipse(frame, center, axes, float(rng.integers(180)), 0, 360, colour, -1)
+        else:
+            end = (center[0] + int(rng.integers(-60, 60)), center[1] + int(rng.integers(-60, 60)))
+            cv2.line(frame, center, end, colour, int(rng.integers(1, 12)))
+    return frame
+
+def nested_frame(center):
+    """A white dot inside the hole of a white ring, on a dark frame."""
+    frame = np.zeros((200, 200, 3), np.uint8)
+    cv2.circle(frame, center, 40, (255, 255, 255), -1)
+    cv2.circle(frame, center, 30, (0, 0, 0), -1)
+    cv2.circle(frame, center, 12, (255, 255, 255), -1)
+    return frame
+
+@pytest.mark.parametrize('center', [(100, 100), (20, 100)])
+def test_blobs_inside_holes_are_ignored(center):
+    # (20, 100) cuts the ring open at the frame edge, exposing the dot
+    frame = nested_frame(center)
+    patches, _ = _find_white_patches(frame)
+    assert sorted(patches) == sorted(contour_patches(frame))
+
+def test_nested_fixture_frames_match_contour_scan():
+    frame = fixture_frame(3)
+    for center in ((150, 150), (400, 300), (600, 60)):
+        cv2.circle(frame, center, 40, (255, 255, 255), -1)
+        cv2.circle(frame, center, 30, (120, 150, 200), -1)
+        cv2.circle(frame, center, 12, (255, 255, 255), -1)
+    patches, _ = _find_white_patches(frame)
+    assert sorted(patches) == sorted(contour_patches(frame))
+
+@pytest.mark.parametrize('seed', range(8))
+def test_matches_contour_scan(seed):
+    frame = fixture_frame(seed)
+    patches, _ = _find_white_patches(frame)
+    assert patches
+    assert sorted(patches) == sorted(contour_patches(frame))
+
+def test_matches_contour_scan_with_scaled_limits():
+    frame = fixture_frame(100)
+    patches, _ = _find_white_patches(frame, MIN_AREA / 4, MAX_AREA / 4)
+    assert sorted(patches) == sorted(contour_patches(frame, MIN_AREA / 4, MAX_AREA / 4))
+
+@pytest.mark.parametrize('seed', range(4))
+def test_top_anomalies_are_the_largest_patches(seed):
+    frame = fixture_frame(seed)
+    expected = sorted(contour_patches(frame), key=lambda p: p[3], reverse=True)[:MAX_ANOMALIES]
+    assert detect_skin_anomalies(frame) == [(x, y, r) for x, y, r, _ in expected]
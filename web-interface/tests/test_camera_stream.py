@@ -0,0 +1,187 @@
+import threading
+import time
+
+import numpy as np
+
+from camera_stream import CameraStream, FrameBufferPool, FrameEncoder
+
+class FakeCamera:
+    """cv2.VideoCapture stand-in that fails `failures` reads after `good` frames."""
+    def __init__(self, good=3, failures=0):
+        self.good = good
+        self.failures = failures
+        self.reads = 0
+        self.released = False
+
+    def read(self):
+        self.reads += 1
+        if self.reads > self.good and self.failures:
+            self.failures -= 1
+            return False, None
+        return True, np.full((4, 4, 3), self.reads % 256, np.uint8)
+
+    def release(self):
+        self.released = True
+
+class PacedCamera:
+    """cv2.VideoCapture stand-in that delivers 640x480 frames at a fixed rate."""
+    def __init__(self, fps):
+        self.interval = 1.0 / fps
+        self.frame = np.zeros((480, 640, 3), np.uint8)
+        self.next = time.perf_counter()
+
+    def read(self):
+        self.next += self.interval
+        delay = self.next - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return True, self.frame
+
+    def release(self):
+        pass
+
+def collect(stream, count):
+    frames = []
+    for seq, frame in stream.frames():
+        frames.append(seq)
+        if len(frames) == count:
+            break
+    return frames
+
+def test_frames_are_published_in_order():
+    stream = CameraStream(FakeCamera())
+    stream.start()
+    try:
+        seqs = collect(stream, 5)
+    finally:
+        stream.stop()
+    assert seqs == sorted(seqs)
+    assert stream.stats['read_errors'] == 0
+
+def test_failed_reads_back_off_and_recover():
+    camera = FakeCamera(good=2, failures=2)
+    stream = CameraStream(camera, max_backoff=0.01)
+    stream.start()
+    try:
+        collect(stream, 6)
+    finally:
+        stream.stop()
+    assert stream.stats['read_errors'] == 2
+    assert camera.released
+
+def test_source_is_reopened_after_a_failure():
+    opened = []
+
+    def reopen():
+        opened.append(FakeCamera(good=1000))
+        return opened[-1]
+
+    first = FakeCamera(good=2, failures=1000)
+    stream = CameraStream(first, reopen=reopen, max_backoff=0.01)
+    stream.start()
+    try:
+        collect(stream, 6)
+    finally:
+        stream.stop()
+    assert first.released
+    assert stream.stats['reopens'] == len(opened) == 1
+    assert stream.source is opened[0]
+
+def test_stop_interrupts_backoff():
+    stream = CameraStream(FakeCamera(good=0, failures=1000), max_backoff=60)
+    stream.start()
+    stopped = threading.Event()
+    threading.Thread(target=lambda: (stream.stop(), stopped.set()), daemon=True).start()
+    assert stopped.wait(2)
+
+def test_buffer_pool_reuses_buffers_except_excluded():
+    pool = FrameBufferPool(size=2)
+    frame = np.zeros((4, 4, 3), np.uint8)
+    previous = None
+    for _ in range(20):
+        buffer = pool.copy_of(frame, exclude=previous)
+        assert buffer is not previous
+        previous = buffer
+
+    assert pool.stats['allocations'] == 2
+    assert len(pool.buffers) == 2
+
+def viewer_frame_rates(viewers, fps=100, duration=0.5):
+    """Frames per second each of `viewers` consumer threads received."""
+    stream = CameraStream(PacedCamera(fps))
+    counts = [0] * viewers
+
+    def view(index):
+        seq, deadline = 0, time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            seq, frame = stream.wait_for_frame(seq, timeout=0.1)
+            if frame is not None:
+                counts[index] += 1
+
+    threads = [threading.Thread(target=view, args=(i,)) for i in range(viewers)]
+    stream.start()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        stream.stop()
+    return [count / duration for count in counts]
+
+def test_benchmark_frame_rate_per_viewer():
+    # Each viewer used to read the device itself, so N viewers split its frame rate
+    rates = {viewers: viewer_frame_rates(viewers) for viewers in (1, 2, 4, 8)}
+    for viewers, per_viewer in rates.items():
+        print(f"{viewers} viewers: min {min(per_viewer):.0f} fps, mean {sum(per_viewer) / viewers:.0f} fps")
+
+    single = rates[1][0]
+    assert single > 50
+    for per_viewer in rates.values():
+        assert min(per_viewer) >= 0.8 * single
+
+def encode_cpu_per_frame(clients, frames):
+    """CPU seconds per frame when `clients` subscribers each fetch every frame."""
+    encoder = FrameEncoder(quality=70)
+    start = time.process_time()
+    for seq, frame in enumerate(frames, 1):
+        for _ in range(clients):
+            chunk = encoder.get_chunk(seq, frame)
+    cpu = (time.process_time() - start) / len(frames)
+    assert chunk.startswith(FrameEncoder.HEADER)
+    assert encoder.stats['encoded'] == len(frames)
+    return cpu
+
+def test_benchmark_encode_cpu_per_frame():
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (480, 640, 3), np.uint8) for _ in range(20)]
+    cpu = {clients: encode_cpu_per_frame(clients, frames) for clients in (1, 2, 4, 8)}
+    for clients, seconds in cpu.items():
+        print(f"{clients} clients: {seconds * 1000:.2f} ms CPU per frame")
+
+    # Encoding per client would make 8 clients cost ~8x
+    assert cpu[8] <= 1.5 * cpu[1] + 0.001
+
+def test_benchmark_render_allocations_per_frame():
+    # Mirrors annotate_frame(): overlays are drawn into a pooled copy that
+    # must not be the buffer the encoder last rendered
+    encoder = FrameEncoder(quality=70)
+    pool = FrameBufferPool()
+
+    def render(seq, frame):
+        buffer = pool.copy_of(frame, exclude=encoder.rendered)
+        buffer[:8, :8] = 255
+        return buffer
+
+    frames, clients = 100, 4
+    frame = np.zeros((480, 640, 3), np.uint8)
+    for seq in range(1, frames + 1):
+        for _ in range(clients):
+            encoder.get_chunk(seq, frame, render)
+
+    per_frame = pool.stats['allocations'] / encoder.stats['rendered']
+    # The old loop made two full-frame copies per frame per client
+    print(f"{clients} clients: {per_frame:.2f} allocations per frame (was {2 * clients})")
+    assert encoder.stats['rendered'] == frames
+    assert pool.stats['allocations'] <= 2
+    assert not frame.any()
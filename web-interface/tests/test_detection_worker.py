@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from detection_worker import DetectionWorker
+
+class GatedAnalyzer:
+    """analyze() stand-in that blocks until released and records what it saw."""
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.frames = []
+
+    def __call__(self, frame):
+        self.frames.append(frame)
+        self.started.set()
+        assert self.release.wait(2)
+        if frame == 'bad':
+            raise ValueError("bad frame")
+        return {'frame': frame}
+
+def wait_until(predicate, timeout=2):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.001)
+
+@pytest.fixture
+def analyzer():
+    return GatedAnalyzer()
+
+@pytest.fixture
+def worker(analyzer):
+    worker = DetectionWorker(analyzer)
+    worker.start()
+    yield worker
+    analyzer.release.set()
+    worker.stop()
+
+def test_pending_frame_is_replaced_while_busy(worker, analyzer):
+    worker.submit(1, 'a')
+    assert analyzer.started.wait(2)
+    worker.submit(2, 'b')
+    worker.submit(3, 'c')
+    analyzer.release.set()
+
+    wait_until(lambda: worker.latest()[0] == 3)
+    assert analyzer.frames == ['a', 'c']
+    assert worker.latest() == (3, {'frame': 'c'})
+    stats = worker.get_stats()
+    assert (stats['submitted'], stats['processed'], stats['dropped']) == (3, 2, 1)
+
+def test_clear_discards_the_result_in_flight(worker, analyzer):
+    worker.submit(1, 'a')
+    assert analyzer.started.wait(2)
+    worker.clear()
+    analyzer.release.set()
+
+    wait_until(lambda: worker.get_stats()['processed'] == 1)
+    assert worker.latest() == (0, None)
+
+def test_worker_survives_analysis_errors(worker, analyzer):
+    analyzer.release.set()
+    worker.submit(1, 'bad')
+    wait_until(lambda: worker.get_stats()['errors'] == 1)
+
+    worker.submit(2, 'good')
+    wait_until(lambda: worker.latest()[0] == 2)
+    assert worker.latest() == (2, {'frame': 'good'})
+    assert worker.get_stats()['processed'] == 1
@@ -0,0 +1,211 @@
+import datetime
+import os
+import stat
+import time
+
+import numpy as np
+import pytest
+from pydicom.dataset import FileDataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import dicom_handler
+from dicom_handler import SC_IMAGE_STORAGE, TRANSFER_SYNTAXES, DICOMHandler, MultiFrameCapture
+
+METADATA = {'patient_name': 'Test^Patient', 'patient_id': 'P001', 'patient_sex': 'F', 'patient_age': '42'}
+POSITIONS = {'m1': 1.5, 'm2': -20.25}
+
+def mode_of(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+@pytest.fixture
+def handler(tmp_path):
+    handler = DICOMHandler(str(tmp_path / 'storage'))
+    yield handler
+    handler.index.close()
+
+def test_capture_tree_is_owner_only(handler):
+    filename = handler.save_as_dicom(np.zeros((48, 64, 3), np.uint8), METADATA, POSITIONS)
+
+    path = handler.storage_folder
+    assert mode_of(path) == 0o700
+    for part in os.path.dirname(filename).split(os.sep):
+        path = os.path.join(path, part)
+        assert mode_of(path) == 0o700, path
+    assert mode_of(os.path.join(handler.storage_folder, filename)) == 0o600
+    assert mode_of(handler.index.db_path) == 0o600
+
+def test_existing_storage_root_is_locked_down(tmp_path):
+    # The preview cache is created first and leaves its parent at the umask default
+    storage = tmp_path / 'storage'
+    os.makedirs(storage / 'previews', mode=0o700)
+    os.chmod(storage, 0o755)
+
+    handler = DICOMHandler(str(storage))
+    handler.index.close()
+    assert mode_of(storage) == 0o700
+
+def test_captures_share_the_patient_session(handler):
+    image = np.zeros((48, 64, 3), np.uint8)
+    first = handler.save_as_dicom(image, METADATA, POSITIONS)
+    second = handler.save_as_dicom(image, METADATA, POSITIONS)
+    burst = handler.new_series(METADATA)
+    third = handler.save_as_dicom(image, METADATA, POSITIONS, series=burst)
+    other = handler.save_as_dicom(image, dict(METADATA, patient_id='P002'), POSITIONS)
+
+    study, series, _ = first.split(os.sep)[1:]
+    assert second.split(os.sep)[1:3] == [study, series]
+    assert third.split(os.sep)[1:3] == [study, burst['series_uid']] and burst['series_uid'] != series
+    assert study not in other
+    records, _ = handler.index.search(patient_id='P001')
+    assert sorted(r['instance_number'] for r in records if r['series_instance_uid'] == series) == [1, 2]
+
+def test_header_round_trip(handler):
+    overlays = {'faces': [[10, 12, 20, 22]], 'anomalies': [[15, 18, 3]]}
+    handler.save_as_dicom(np.zeros((48, 64, 3), np.uint8), METADATA, POSITIONS, overlays=overlays)
+    (record,), total = handler.index.search(patient_id='P001')
+    assert total == 1
+
+    header = handler.read_header(record['sop_instance_uid'])
+    assert header['patient_id'] == 'P001'
+    assert header['patient_age'] == '042Y'
+    assert (header['rows'], header['columns']) == (48, 64)
+    assert header['m1_angle'] == 1.5
+    assert header['m2_angle'] == -20.25
+    assert header['overlays'] == overlays
+    assert handler.read_header('1.2.3.4') is None
+
+def test_multiframe_header_round_trip(handler):
+    capture = MultiFrameCapture()
+    for i in range(3):
+        capture.append(np.full((32, 40, 3), i, np.uint8), {'m1': i * 2.0, 'm2': -i * 1.0})
+    handler.save_multiframe(capture, METADATA)
+    (record,), _ = handler.index.search()
+
+    header = handler.read_header(record['sop_instance_uid'])
+    assert header['number_of_frames'] == 3
+    assert [frame['m1_angle'] for frame in header['frames']] == [0.0, 2.0, 4.0]
+    assert [frame['m2_angle'] for frame in header['frames']] == [0.0, -1.0, -2.0]
+
+    image = handler.load_image(record['sop_instance_uid'])
+    assert image.shape == (32, 40, 3)
+    assert not image.any()
+
+def test_load_image_from_jpeg_baseline(tmp_path):
+    handler = DICOMHandler(str(tmp_path / 'storage'), transfer_syntax='jpeg_baseline')
+    image = np.full((48, 64, 3), (200, 100, 50), np.uint8)
+    handler.save_as_dicom(image, METADATA, POSITIONS)
+    (record,), _ = handler.index.search()
+
+    loaded = handler.load_image(record['sop_instance_uid'])
+    handler.index.close()
+    assert loaded.shape == image.shape
+    assert np.abs(loaded.astype(int) - image).max() <= 4
+
+def camera_like_image(height=240, width=320):
+    """Smooth gradients with a little sensor noise, so it compresses like a real capture."""
+    rng = np.random.default_rng(0)
+    y, x = np.mgrid[0:height, 0:width]
+    image = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    return np.clip(image + rng.integers(-2, 3, image.shape), 0, 255).astype(np.uint8)
+
+def test_unencodable_syntax_fails_at_startup(tmp_path, monkeypatch):
+    class Missing:
+        is_available = False
+        missing_dependencies = ['pyjpegls']
+
+    monkeypatch.setattr(dicom_handler, 'get_encoder', lambda uid: Missing())
+    with pytest.raises(ValueError, match='pyjpegls'):
+        DICOMHandler(str(tmp_path / 'storage'), transfer_syntax='jpeg_ls')
+
+def test_benchmark_transfer_syntaxes(tmp_path):
+    image = camera_like_image()
+    stats = {}
+    for syntax in TRANSFER_SYNTAXES:
+        try:
+            handler = DICOMHandler(str(tmp_path / syntax), transfer_syntax=syntax)
+        except ValueError as e:
+            # Encoder plugin not installed here (e.g. pyjpegls)
+            print(f"{syntax}: unavailable ({e})")
+            continue
+        for _ in range(3):
+            handler.save_as_dicom(image, METADATA, POSITIONS)
+        record = handler.index.search()[0][0]
+        loaded = handler.load_image(record['sop_instance_uid'])
+        handler.index.close()
+        (stored, entry), = handler.get_stats().items()
+        stats[syntax] = entry
+        print(f"{syntax}: {entry['avg_bytes'] / 1024:.0f} KiB, encode {entry['avg_encode_ms']:.1f} ms")
+        assert stored == syntax
+        if syntax != 'jpeg_baseline':
+            assert np.array_equal(loaded, image), syntax
+
+    assert {'explicit', 'jpeg_baseline', 'rle'} <= stats.keys()
+    assert stats['explicit']['avg_bytes'] > image.nbytes
+    assert stats['jpeg_baseline']['avg_bytes'] < image.nbytes / 4
+
+def build_from_scratch(metadata, positions):
+    """How save_as_dicom() used to build every dataset before templates, minus the pixels."""
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = SC_IMAGE_STORAGE
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    file_meta.ImplementationClassUID = generate_uid()
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(None, {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.PatientName = metadata['patient_name']
+    ds.PatientID = metadata['patient_id']
+    ds.PatientSex = metadata['patient_sex']
+    ds.PatientAge = f"{int(metadata['patient_age']):03d}Y"
+    ds.StudyDate = datetime.datetime.now().strftime('%Y%m%d')
+    ds.StudyTime = datetime.datetime.now().strftime('%H%M%S')
+    ds.Modality = 'OT'
+    ds.ImageComments = f"M1_Angle:{positions['m1']:.2f}, M2_Angle:{positions['m2']:.2f}"
+    block = ds.private_block(0x0019, "RoboticCamera", create=True)
+    block.add_new(0x01, 'DS', str(round(positions['m1'], 2)))
+    block.add_new(0x02, 'DS', str(round(positions['m2'], 2)))
+    ds.SamplesPerPixel = 3
+    ds.PhotometricInterpretation = "RGB"
+    ds.PlanarConfiguration = 0
+    ds.BitsAllocated = 8
+    ds.BitsStored = 8
+    ds.HighBit = 7
+    ds.PixelRepresentation = 0
+    ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    return ds
+
+def build_from_template(handler, metadata, positions, series):
+    """The dataset-building part of save_as_dicom(), minus the pixels."""
+    ds = handler._build_dataset(SC_IMAGE_STORAGE, metadata, series, 1, datetime.datetime.now())
+    ds.ImageComments = f"M1_Angle:{positions['m1']:.2f}, M2_Angle:{positions['m2']:.2f}"
+    ds.add(handler._private_element(0x01, 'DS', str(round(positions['m1'], 2))))
+    ds.add(handler._private_element(0x02, 'DS', str(round(positions['m2'], 2))))
+    return ds
+
+def builds_per_second(build, count=500, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(count):
+            build()
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+def test_benchmark_dataset_construction(handler):
+    # Pixel handling is the same either way, so only the headers are compared
+    before = builds_per_second(lambda: build_from_scratch(METADATA, POSITIONS))
+    # The old code had no study/series UIDs, so the template gets one fixed series
+    series = handler.new_series(METADATA)
+    after = builds_per_second(lambda: build_from_template(handler, METADATA, POSITIONS, series))
+    image = np.zeros((480, 640, 3), np.uint8)
+    for _ in range(20):
+        handler.save_as_dicom(image, METADATA, POSITIONS)
+    saves = handler.get_stats()['explicit']['saves_per_second']
+    print(f"datasets/s: {before:.0f} from scratch, {after:.0f} from template; full saves/s: {saves:.0f}")
+
+    first, second = (build_from_template(handler, METADATA, POSITIONS, series) for _ in range(2))
+    assert first.file_meta.ImplementationClassUID == second.file_meta.ImplementationClassUID
+    assert first.SOPInstanceUID != second.SOPInstanceUID
+    assert 'PatientName' not in handler.templates[SC_IMAGE_STORAGE]
+    assert first.private_block(0x0019, "RoboticCamera")[0x01].value == 1.5
+    assert after > before
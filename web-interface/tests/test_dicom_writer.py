@@ -0,0 +1,75 @@
+import os
+import queue
+import threading
+
+import numpy as np
+import pytest
+
+from dicom_writer import DICOMWriteQueue
+
+class FakeHandler:
+    """Writes an empty file per save; blocks every save until `gate` is set."""
+    def __init__(self, storage_folder):
+        self.storage_folder = storage_folder
+        self.gate = threading.Event()
+        self.count = 0
+
+    def save_as_dicom(self, image_array, metadata, motor_positions, overlays=None, **kwargs):
+        self.gate.wait(5)
+        self.count += 1
+        filename = f"{self.count}.dcm"
+        open(os.path.join(self.storage_folder, filename), 'wb').close()
+        return filename
+
+FRAME = np.zeros((4, 4, 3), np.uint8)
+
+@pytest.fixture
+def writer(tmp_path):
+    handler = FakeHandler(str(tmp_path))
+    writer = DICOMWriteQueue(handler, max_frames=10, fsync_batch=4)
+    yield writer
+    handler.gate.set()
+    writer.stop()
+
+def wait_done(writer, job_id):
+    for _ in range(500):
+        if writer.get_job(job_id)['status'] in ('done', 'error'):
+            return writer.get_job(job_id)
+        threading.Event().wait(0.01)
+    raise AssertionError("job did not finish")
+
+def test_queue_is_bounded_by_frames_not_jobs(writer):
+    writer.reserve(6)
+    writer.reserve(4)
+    with pytest.raises(queue.Full):
+        writer.submit(FRAME, {}, {})
+    with pytest.raises(queue.Full):
+        writer.reserve(1)
+    assert writer.get_stats()['pending_frames'] == 10
+
+def test_failed_reservation_releases_frames(writer):
+    job_id = writer.reserve(10)
+    writer.fail(job_id, "no camera")
+    assert writer.get_stats()['pending_frames'] == 0
+    writer.reserve(10)
+
+def test_short_burst_settles_its_reservation(writer):
+    job_id = writer.reserve(8)
+    frames = [(FRAME, {'m1': 0, 'm2': 0}, None)] * 3
+    writer.submit_series(frames, {}, {'study_uid': '1', 'series_uid': '2'}, job_id)
+    assert writer.get_stats()['pending_frames'] == 3
+
+    writer.handler.gate.set()
+    job = wait_done(writer, job_id)
+    assert job['status'] == 'done'
+    assert len(job['filenames']) == 3
+    assert writer.get_stats()['pending_frames'] == 0
+
+def test_written_files_are_synced(writer):
+    writer.handler.gate.set()
+    job = wait_done(writer, writer.submit(FRAME, {}, {}))
+    for _ in range(100):
+        if writer.get_job(job['id'])['synced']:
+            break
+        threading.Event().wait(0.01)
+    assert writer.get_job(job['id'])['synced']
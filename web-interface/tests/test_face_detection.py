@@ -0,0 +1,119 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from face_detection import (FRONTAL_FACE, HAAR_PRESETS, CascadeRegistry, _detect_multires, _refine_face,
+                            detect_faces)
+
+# Haar cascades are not in every OpenCV build (e.g. 5.x without contrib)
+requires_haar = pytest.mark.skipif(not hasattr(cv2, 'CascadeClassifier'), reason="OpenCV built without Haar cascades")
+
+class StubCascade:
+    """CascadeClassifier stand-in returning canned hits and recording each call."""
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = []
+
+    def detectMultiScale(self, image, **kwargs):
+        self.calls.append((image.shape, kwargs))
+        return self.results.pop(0) if self.results else []
+
+def per_call(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls
+
+def test_multires_maps_hits_back_to_full_resolution():
+    preset = HAAR_PRESETS['haar_multires']._replace(downscale=0.5, refine=False)
+    cascade = StubCascade([(10, 20, 30, 40)])
+    gray = np.zeros((480, 640), np.uint8)
+
+    assert _detect_multires(cascade, gray, preset) == [(20, 40, 60, 80)]
+    (shape, kwargs), = cascade.calls
+    assert shape == (240, 320)
+    assert kwargs['minSize'] == (15, 15)
+
+def test_refine_roi_is_clamped_to_the_frame():
+    preset = HAAR_PRESETS['haar_multires']
+    gray = np.zeros((100, 120), np.uint8)
+
+    # Padding would reach past the top-left corner
+    cascade = StubCascade([(3, 4, 36, 38)])
+    assert _refine_face(cascade, gray, (0, 0, 40, 40), preset) == (3, 4, 36, 38)
+    # ...and past the bottom-right corner; hits are offset by the ROI origin
+    cascade.results.append([(2, 1, 40, 40)])
+    assert _refine_face(cascade, gray, (90, 70, 40, 40), preset) == (82, 61, 40, 40)
+    (first, _), (second, _) = cascade.calls
+    assert first == (50, 50)
+    assert second == (100 - 60, 120 - 80)
+
+def test_refine_keeps_the_coarse_rect_on_a_miss():
+    preset = HAAR_PRESETS['haar_multires']
+    rect = (30, 20, 40, 40)
+    assert _refine_face(StubCascade([]), np.zeros((100, 120), np.uint8), rect, preset) == rect
+
+def test_multires_refines_each_hit():
+    preset = HAAR_PRESETS['haar_multires']._replace(downscale=0.5)
+    cascade = StubCascade([(40, 30, 20, 20)], [(12, 8, 36, 36)])
+    faces = _detect_multires(cascade, np.zeros((240, 320), np.uint8), preset)
+    # Coarse hit (80, 60, 40, 40) padded by 10 px: ROI origin (70, 50)
+    assert faces == [(82, 58, 36, 36)]
+
+@requires_haar
+def test_registry_loads_once_per_thread():
+    registry = CascadeRegistry()
+    cascade = registry.get(FRONTAL_FACE)
+    assert cascade is not None
+    assert registry.get(FRONTAL_FACE) is cascade
+
+    other = []
+    thread = threading.Thread(target=lambda: other.append(registry.get(FRONTAL_FACE)))
+    thread.start()
+    thread.join()
+    assert other[0] is not None and other[0] is not cascade
+
+@requires_haar
+def test_missing_cascade_is_not_reloaded():
+    registry = CascadeRegistry()
+    assert registry.get('missing.xml') is None
+    assert registry.local.cascades['missing.xml'] is False
+
+@requires_haar
+def test_benchmark_detect_faces_latency():
+    rng = np.random.default_rng(0)
+    # A small frame keeps detection cheap, so the per-call load cost shows
+    frame = rng.integers(0, 256, (120, 160, 3), np.uint8)
+    preset = HAAR_PRESETS['haar_balanced']
+
+    def reload_every_call():
+        # What detect_faces() used to do on every call
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + FRONTAL_FACE)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        cascade.detectMultiScale(gray, scaleFactor=preset.scale_factor,
+                                 minNeighbors=preset.min_neighbors, minSize=preset.min_size)
+
+    detect_faces(frame, 'haar_balanced')  # Load this thread's cascade
+    before = per_call(reload_every_call, 10)
+    after = per_call(lambda: detect_faces(frame, 'haar_balanced'), 10)
+    load = per_call(lambda: cv2.CascadeClassifier(cv2.data.haarcascades + FRONTAL_FACE), 5)
+    print(f"detect_faces: {before * 1000:.1f} ms reloading, {after * 1000:.1f} ms cached "
+          f"(cascade load {load * 1000:.1f} ms)")
+
+    assert after < 0.5 * before
+
+@requires_haar
+def test_benchmark_multires_detection():
+    rng = np.random.default_rng(0)
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (480, 640, 3), np.uint8), (5, 5), 0)
+    detect_faces(frame, 'haar_multires')  # Load this thread's cascade
+    full = per_call(lambda: detect_faces(frame, 'haar_balanced'), 5)
+    multires = per_call(lambda: detect_faces(frame, 'haar_multires'), 5)
+    print(f"640x480 detection: {full * 1000:.1f} ms full resolution, {multires * 1000:.1f} ms multi-resolution "
+          f"({full / multires:.1f}x)")
+
+    assert multires < 0.5 * full
+
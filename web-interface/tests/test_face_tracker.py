@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+
+from face_detection import FaceTracker
+
+def textured_scene(shape=(240, 320), seed=0):
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, shape, dtype=np.uint8)
+    return cv2.GaussianBlur(noise, (5, 5), 0)
+
+def shifted(image, dx, dy):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(image, matrix, (image.shape[1], image.shape[0]), borderMode=cv2.BORDER_REFLECT)
+
+def test_boxes_follow_motion_since_the_detection_frame():
+    source = textured_scene()
+    box = (100, 80, 80, 80)
+    tracker = FaceTracker()
+    tracker.reset(source, [box], source_seq=10)
+
+    # Detection latency: the scene has moved by the time the result is used
+    (x, y, w, h), = tracker.update(shifted(source, 6, -4))
+    assert abs(x - (box[0] + 6)) <= 1
+    assert abs(y - (box[1] - 4)) <= 1
+    assert (w, h) == box[2:]
+    assert tracker.confidence > 0.5
+    assert tracker.source_seq == 10
+
+def test_features_are_seeded_inside_the_box():
+    source = textured_scene()
+    box = (100, 80, 80, 80)
+    tracker = FaceTracker(inset=0.25)
+    tracker.reset(source, [box], source_seq=1)
+
+    (_, points), = tracker.tracks
+    points = points.reshape(-1, 2)
+    assert (points[:, 0] >= 120).all() and (points[:, 0] < 160).all()
+    assert (points[:, 1] >= 100).all() and (points[:, 1] < 140).all()
+
+def test_untrackable_faces_are_kept_until_the_next_reset():
+    flat = np.full((240, 320), 128, np.uint8)
+    box = (100, 80, 80, 80)
+    tracker = FaceTracker()
+    assert tracker.reset(flat, [box], source_seq=5) == [box]
+    assert tracker.update(flat) == [box]
+    assert tracker.seeded_points == 0
+
+    tracker.reset(textured_scene(), [], source_seq=6)
+    assert tracker.update(textured_scene()) == []
+
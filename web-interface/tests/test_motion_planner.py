@@ -0,0 +1,135 @@
+import pytest
+
+from motor_controller import MotorController, MotionPlanner
+from step_backends import SimulatedBackend
+
+PINS = {'EN1': 21, 'DIR1': 20, 'STEP1': 16, 'EN2': 26, 'DIR2': 14, 'STEP2': 15}
+STEP_AXES = {PINS['STEP1']: 'm1', PINS['STEP2']: 'm2'}
+STEP_DELAY = 0.003
+MIN_RATE = 1 / (2 * STEP_DELAY)
+
+@pytest.fixture
+def planner():
+    return MotionPlanner(MIN_RATE, 2000, 4000, 20000)
+
+@pytest.fixture
+def controller(planner):
+    # The control thread is stopped so plans can be stepped tick by tick
+    controller = MotorController(PINS, 0.1, 0.1, STEP_DELAY, planner, SimulatedBackend())
+    controller.stop()
+    return controller
+
+def simulate(controller, commands=None, max_ticks=200000):
+    """
+    Run the control loop's planning synchronously, one tick at a time.
+    `commands` maps a tick number to a callable applied before that tick.
+    Returns [(motors, interval)] for every tick played.
+    """
+    commands = dict(commands or {})
+    plan, generation, history = None, None, []
+    while len(history) < max_ticks:
+        if len(history) in commands:
+            commands.pop(len(history))(controller)
+        if plan is None or generation != controller.generation:
+            plan = controller._plan_move(None if controller.halt else plan)
+            generation = controller.generation
+            controller.halt = False
+        ticks = controller._reserve_ticks(plan, 1e-9)
+        if not ticks:
+            if controller.state['m1_pending'] or controller.state['m2_pending']:
+                plan = None
+                continue
+            if not commands:
+                break
+            commands[len(history)] = commands.pop(min(commands))
+            continue
+        (pins, interval), = ticks
+        history.append(({STEP_AXES[pin] for pin in pins}, interval))
+    return history
+
+def axis_rates(history, motor):
+    """Step rate of one axis between each of its consecutive steps."""
+    now, times = 0.0, []
+    for motors, interval in history:
+        if motor in motors:
+            times.append(now)
+        now += interval
+    return [1 / (b - a) for a, b in zip(times, times[1:])]
+
+def max_rate_jump(rates):
+    return max((abs(b - a) for a, b in zip(rates, rates[1:])), default=0.0)
+
+def test_long_moves_are_faster_than_constant_rate(planner):
+    constant = MotionPlanner(MIN_RATE, MIN_RATE)
+    for steps in (1, 10, 100, 1000, 9600):
+        assert planner.move_time(steps) <= constant.move_time(steps) + 1e-9
+    # One base revolution at 8x microstepping
+    assert planner.move_time(9600) < 0.1 * constant.move_time(9600)
+
+def test_benchmark_move_time_by_distance(planner):
+    constant = MotionPlanner(MIN_RATE, MIN_RATE)
+    # Jog steps up to one M1 revolution at 8x microstepping
+    distances = (1, 10, 50, 200, 1000, 9600)
+    for steps in distances:
+        old, new = constant.move_time(steps), planner.move_time(steps)
+        print(f"{steps:5d} steps: {old:7.3f} s constant, {new:6.3f} s S-curve ({old / new:4.1f}x)")
+
+    times = [planner.move_time(steps) for steps in distances]
+    assert times == sorted(times)
+
+def test_ramp_is_symmetric_and_bounded(planner):
+    indices = planner.indices(2000)
+    assert indices[0] == indices[-1] == 0
+    assert indices == indices[::-1]
+    assert max_rate_jump([planner.rate(i) for i in indices]) <= MIN_RATE
+
+def test_diagonal_moves_in_straight_line(controller):
+    controller.move_motor('m1', 'forward', 100)
+    controller.move_motor('m2', 'backward', 37)
+    history = simulate(controller)
+
+    assert len(history) == 100
+    assert sum('m2' in motors for motors, _ in history) == 37
+    assert controller.state['m1_pos'] == 100
+    assert controller.state['m2_pos'] == -37
+
+def test_extending_a_move_keeps_cruise_speed(controller, planner):
+    controller.move_motor('m1', 'forward', 3000)
+    history = simulate(controller, {1000: lambda c: c.move_motor('m1', 'forward', 500)})
+
+    assert 1 / history[1000][1] == pytest.approx(1 / history[999][1])
+    assert max_rate_jump(axis_rates(history, 'm1')) <= MIN_RATE
+    assert controller.state['m1_pos'] == 3500
+
+def test_shortening_a_move_brakes_and_returns(controller, planner):
+    controller.move_motor('m1', 'forward', 3000)
+    # 50 steps ahead is far too short to stop in from cruise speed
+    history = simulate(controller, {1000: lambda c: c.set_target_angle('m1', (c.state['m1_pos'] + 50) * 0.1)})
+
+    assert 1 / history[999][1] == pytest.approx(planner.max_rate)
+    assert max_rate_jump([1 / interval for _, interval in history]) <= MIN_RATE
+    assert controller.state['m1_pos'] == controller.target_steps['m1'] == 1050
+
+def test_major_axis_change_restarts_from_rest(controller, planner):
+    controller.move_motor('m1', 'forward', 3000)
+
+    # m1 brakes from cruise over len(ramp) - 1 steps, then m2 becomes the
+    # major axis. m2's distance is chosen so m1 then steps on exactly every
+    # other tick; an irregular ratio would add Bresenham jitter to m1's rate.
+    m1_left = 2000 - (len(planner.ramp) - 1)
+    history = simulate(controller, {1000: lambda c: c.move_motor('m2', 'forward', 2 * m1_left)})
+
+    assert max_rate_jump(axis_rates(history, 'm1')) <= MIN_RATE
+    m2_rates = axis_rates(history, 'm2')
+    assert m2_rates[0] == pytest.approx(MIN_RATE)
+    assert max_rate_jump(m2_rates) <= MIN_RATE
+    assert controller.state['m1_pos'] == 3000
+    assert controller.state['m2_pos'] == 2 * m1_left
+
+def test_emergency_stop_halts_without_braking(controller):
+    controller.move_motor('m1', 'forward', 3000)
+    history = simulate(controller, {1000: lambda c: c.emergency_stop()})
+
+    assert len(history) == 1000
+    assert controller.state['m1_pos'] == 1000
+    assert not controller.is_moving()
@@ -0,0 +1,101 @@
+import time
+
+import pytest
+
+from motor_controller import MotorController
+from step_backends import SimulatedBackend
+
+PINS = {'EN1': 21, 'DIR1': 20, 'STEP1': 16, 'EN2': 26, 'DIR2': 14, 'STEP2': 15}
+# 1 ms per step at a constant rate keeps wall-clock timings predictable
+STEP_DELAY = 0.0005
+TICK = 2 * STEP_DELAY
+
+@pytest.fixture
+def backend():
+    return SimulatedBackend()
+
+@pytest.fixture
+def controller(backend):
+    controller = MotorController(PINS, 0.1, 0.1, STEP_DELAY, backend=backend)
+    yield controller
+    controller.stop()
+
+def test_diagonal_move_takes_the_longer_axis_time(controller, backend):
+    controller.move_motor('m1', 'forward', 200)
+    controller.move_motor('m2', 'backward', 80)
+    assert controller.wait_until_idle(timeout=5)
+
+    ticks = list(backend.ticks)
+    assert len(ticks) == 200
+    assert sum(PINS['STEP1'] in pins for _, pins, _ in ticks) == 200
+    assert sum(PINS['STEP2'] in pins for _, pins, _ in ticks) == 80
+    assert controller.get_positions() == {'m1': pytest.approx(20.0), 'm2': pytest.approx(-8.0)}
+
+    # Stepping the axes one after the other would take 280 ticks
+    elapsed = ticks[-1][0] - ticks[0][0]
+    assert elapsed == pytest.approx(199 * TICK, rel=0.2)
+    assert elapsed < 250 * TICK
+
+def test_get_positions_does_not_wait_for_step_pulses(controller):
+    controller.move_motor('m1', 'forward', 2000)
+    controller.move_motor('m2', 'forward', 1500)
+    time.sleep(0.05)
+
+    latencies = []
+    for _ in range(200):
+        start = time.perf_counter()
+        controller.get_positions()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    assert controller.is_moving()
+    controller.emergency_stop()
+
+    latencies.sort()
+    # The old loop held the lock for up to 12 ms of pulses
+    assert latencies[len(latencies) // 2] < 0.0005
+    assert latencies[-1] < 0.005
+
+def test_command_to_first_pulse_latency(controller, backend):
+    latencies = []
+    for _ in range(20):
+        # Let the control thread settle into its idle wait
+        time.sleep(0.005)
+        backend.ticks.clear()
+        start = time.perf_counter()
+        controller.move_motor('m1', 'forward', 1)
+        assert controller.wait_until_idle(timeout=1)
+        latencies.append(backend.ticks[0][0] - start)
+
+    latencies.sort()
+    # The old loop polled every 10 ms
+    assert latencies[len(latencies) // 2] < 0.002
+    assert latencies[-1] < 0.01
+
+def test_move_to_is_refused_after_emergency_stop(controller):
+    stops = controller.stops
+    assert controller.move_to({'m1': 2.0, 'm2': -1.0}, stops)
+    assert controller.wait_until_idle(timeout=5)
+    assert controller.at_target({'m1': 2.0, 'm2': -1.0})
+
+    assert controller.move_to({'m1': 200.0}, stops)
+    time.sleep(0.05)
+    controller.emergency_stop()
+    assert controller.wait_until_idle(timeout=5)
+    # The stop leaves the arm short of its target, and later moves are refused
+    assert not controller.at_target({'m1': 200.0})
+    position = controller.get_positions()
+    assert not controller.move_to({'m1': 0.0}, stops)
+    time.sleep(0.05)
+    assert controller.get_positions() == position
+
+def test_tare_waits_for_the_chunk_in_flight(controller, backend):
+    controller.move_motor('m1', 'forward', 2000)
+    # Land mid-chunk: the stepper plays chunk_time worth of ticks at a time
+    time.sleep(0.1 + controller.chunk_time / 2)
+    controller.tare_position()
+    pulses = len(backend.ticks)
+
+    assert controller.wait_until_idle(timeout=1)
+    # Every step counted before the tare was pulsed before it returned
+    assert len(backend.ticks) == pulses
+    assert controller.get_positions() == {'m1': 0.0, 'm2': 0.0}
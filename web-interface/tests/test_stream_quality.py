@@ -0,0 +1,69 @@
+import pytest
+
+import stream_quality
+from stream_quality import QUALITY_LADDER, AdaptiveStreamController
+
+TARGET = 0.1
+SLOW, FAST, OK = 0.2, 0.01, 0.07  # Drain times: over target, under half of it, in between
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(stream_quality.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def controller(clock):
+    # No smoothing, so each record() sees exactly the drain time fed in
+    return AdaptiveStreamController('test', TARGET, level=1, smoothing=1.0, hold_time=1.0, upgrade_time=5.0)
+
+def feed(controller, clock, at, drain_time):
+    clock.now = at
+    controller.record(drain_time, 10000)
+    return controller.level
+
+def test_downgrades_are_spaced_by_hold_time(controller, clock):
+    assert feed(controller, clock, 0.5, SLOW) == 1
+    assert feed(controller, clock, 1.0, SLOW) == 2
+    assert feed(controller, clock, 1.9, SLOW) == 2
+    assert feed(controller, clock, 2.0, SLOW) == 3
+
+def test_upgrade_needs_a_sustained_fast_period(controller, clock):
+    assert feed(controller, clock, 2.0, FAST) == 1
+    assert feed(controller, clock, 6.9, FAST) == 1
+    assert feed(controller, clock, 7.0, FAST) == 0
+
+def test_upgrade_timer_restarts_when_drain_is_not_fast(controller, clock):
+    feed(controller, clock, 2.0, FAST)
+    assert feed(controller, clock, 4.0, OK) == 1
+    assert feed(controller, clock, 5.0, FAST) == 1
+    assert feed(controller, clock, 9.9, FAST) == 1
+    assert feed(controller, clock, 10.0, FAST) == 0
+
+def test_level_stays_within_the_ladder(controller, clock):
+    for second in range(1, 20):
+        feed(controller, clock, second, SLOW)
+    assert controller.level == len(QUALITY_LADDER) - 1
+
+    controller.level = 0
+    for second in range(20, 40):
+        feed(controller, clock, second, FAST)
+    assert controller.level == 0
+
+def test_should_send_skips_frames(controller):
+    controller.level = len(QUALITY_LADDER) - 1
+    skip = controller.settings.skip
+    assert skip > 1
+    sent = [controller.should_send() for _ in range(3 * skip)]
+    assert sent == ([False] * (skip - 1) + [True]) * 3
+    assert controller.frames_skipped == 3 * (skip - 1)
+
+    controller.level = 0
+    assert all(controller.should_send() for _ in range(5))
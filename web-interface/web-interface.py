@@ -1,40 +1,68 @@
 import cv2
 import time
 import threading
+import queue
 import logging
-import numpy as np
-from flask import Flask, Response, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, send_file
 
 from config import (
     MOTOR_PINS, STEPS_PER_REV_M1, STEPS_PER_REV_M2, MICROSTEPPING, 
-    DEG_PER_STEP_M1, DEG_PER_STEP_M2, STEP_DELAY,
-    MQTT_HOST, MQTT_PORT, TEMI_SERIAL, STORAGE_FOLDER, HOST, PORT, DEBUG
+    DEG_PER_STEP_M1, DEG_PER_STEP_M2, STEP_DELAY, MAX_STEP_RATE, STEP_ACCELERATION, STEP_JERK,
+    STEP_BACKEND, STEP_CHUNK_TIME,
+    MQTT_HOST, MQTT_PORT, TEMI_SERIAL, STORAGE_FOLDER, HOST, PORT, DEBUG,
+    TRACKING_REDETECT_INTERVAL, TRACKING_MIN_CONFIDENCE, CAMERA_WIDTH, CAMERA_HEIGHT,
+    BURST_MAX_FRAMES, BURST_MAX_DURATION, DICOM_TRANSFER_SYNTAX, DICOM_JPEG_QUALITY,
+    DICOM_STREAM_JPEG_MIN_QUALITY, SWEEP_MAX_POSITIONS, SWEEP_MOVE_TIMEOUT, SWEEP_SETTLE_TIME,
+    PREVIEW_FOLDER, PREVIEW_CACHE_MAX_BYTES, CAPTURE_LIST_MAX_LIMIT
 )
-from motor_controller import MotorController
-from dicom_handler import DICOMHandler
+from motor_controller import MotorController, MotionPlanner
+from step_backends import create_backend
+from dicom_handler import DICOMHandler, MultiFrameCapture
+from dicom_writer import DICOMWriteQueue
 from temi_controller import TemiController
+from camera_stream import CameraStream, FrameEncoder, FrameBufferPool
+from detection_worker import DetectionWorker
+from face_detection import HAAR_PRESETS, FaceTracker, detect_faces
+from anomaly_detection import detect_anomalies_in_faces, detect_anomalies_downscaled
+from frame_metrics import frame_metrics
+from stream_quality import StreamClients
+from preview_cache import PreviewCache
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Initialize components
-motor_controller = MotorController(MOTOR_PINS, DEG_PER_STEP_M1, DEG_PER_STEP_M2, STEP_DELAY)
-dicom_handler = DICOMHandler(STORAGE_FOLDER)
+motion_planner = MotionPlanner(1.0 / (2 * STEP_DELAY), MAX_STEP_RATE, STEP_ACCELERATION, STEP_JERK)
+motor_controller = MotorController(MOTOR_PINS, DEG_PER_STEP_M1, DEG_PER_STEP_M2, STEP_DELAY, motion_planner,
+                                   create_backend(STEP_BACKEND), STEP_CHUNK_TIME)
+preview_cache = PreviewCache(PREVIEW_FOLDER, PREVIEW_CACHE_MAX_BYTES)
+dicom_handler = DICOMHandler(STORAGE_FOLDER, DICOM_TRANSFER_SYNTAX, DICOM_JPEG_QUALITY, preview_cache)
+dicom_writer = DICOMWriteQueue(dicom_handler)
 temi_controller = TemiController(MQTT_HOST, MQTT_PORT, TEMI_SERIAL)
 
 # Flask App
 app = Flask(__name__)
-camera = cv2.VideoCapture(0)
-global_frame = None
+def open_camera():
+    camera = cv2.VideoCapture(0)
+    camera.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
+    return camera
+
+camera_stream = CameraStream(open_camera(), reopen=open_camera)
+camera_stream.start()
+frame_encoder = FrameEncoder(quality=70)
+stream_clients = StreamClients()
+frame_buffers = FrameBufferPool()
+latest_overlays = None  # Overlay data drawn onto the newest rendered frame, keyed by its frame seq
 frame_lock = threading.Lock()
 detection_enabled = False  # Toggle for face tracking
 anomaly_detection_enabled = False  # Toggle for skin anomaly detection
-detection_mode = 'haar_balanced'  # Options: 'haar_fast', 'haar_balanced', 'haar_accurate'
+detection_mode = 'haar_balanced'  # Any key of HAAR_PRESETS
 detection_interval = 3  # Process face detection every N frames to reduce latency
-frame_counter = 0
-last_faces = []
-last_anomalies = []
+face_tracker = FaceTracker()
+tracker_stats = {'frames': 0, 'time': 0.0, 'redetects': 0}
+redetect_requested_seq = 0  # Tracker seed for which an early re-detection was already requested
 
 # Load DNN model for face detection (if available)
 # Download model files from:
@@ -44,144 +72,161 @@ last_anomalies = []
 dnn_available = False
 face_net = None
 
-def detect_faces(frame, mode='haar_balanced'):
-    try:
-        # Convert to grayscale for cascade methods
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        face_rects = []
-        
-        if mode.startswith('haar'):
-            # Haar cascade detection
-            try:
-                face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                if face_cascade.empty():
-                    return []
-            except:
-                return []
-            
-            # Parameters based on mode
-            if mode == 'haar_fast':
-                scaleFactor = 1.3
-                minNeighbors = 3
-                minSize = (20, 20)
-            elif mode == 'haar_balanced':
-                scaleFactor = 1.1
-                minNeighbors = 5
-                minSize = (30, 30)
-            elif mode == 'haar_accurate':
-                scaleFactor = 1.05
-                minNeighbors = 7
-                minSize = (40, 40)
-            else:
-                scaleFactor = 1.1
-                minNeighbors = 5
-                minSize = (30, 30)
-            
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=scaleFactor, minNeighbors=minNeighbors, minSize=minSize)
-            for (x, y, w, h) in faces:
-                face_rects.append((x, y, w, h))
-        
-        
-        
-        return face_rects
-    except Exception as e:
-        logger.error(f"Error in face detection: {e}")
-        return []
+def analyze_frame(frame):
+    """Run the enabled detectors on one frame. Called from the detection worker thread."""
+    faces = []
+    if detection_enabled:
+        start = time.perf_counter()
+        faces = detect_faces(frame, detection_mode)
+        frame_metrics.observe('face_ms', 1000 * (time.perf_counter() - start))
+        frame_metrics.incr('faces', len(faces))
+
+    anomalies = []
+    if anomaly_detection_enabled:
+        start = time.perf_counter()
+        # When face tracking has found faces only the skin around them is
+        # searched; otherwise a cheaper downscaled pass covers the whole frame
+        if faces:
+            anomalies = detect_anomalies_in_faces(frame, faces)
+        else:
+            anomalies = detect_anomalies_downscaled(frame)
+        frame_metrics.observe('anomaly_ms', 1000 * (time.perf_counter() - start))
+        frame_metrics.incr('anomalies', len(anomalies))
+
+    frame_metrics.incr('analyzed_frames')
+    frame_metrics.maybe_flush()
+    result = {'faces': faces, 'anomalies': anomalies}
+    if detection_enabled and HAAR_PRESETS[detection_mode].track:
+        # The tracker seeds on the frame the faces were found in, not on
+        # whatever frame is current when the result arrives
+        result['gray'] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return result
+
+def submit_for_detection(seq, frame):
+    """Capture-thread listener: hand every detection_interval-th frame to the worker."""
+    # In tracking mode the tracker carries face boxes between detections, so
+    # full detection runs far less often. Anomalies aren't tracked, so they
+    # keep the normal rate.
+    tracking_only = HAAR_PRESETS[detection_mode].track and not anomaly_detection_enabled
+    interval = TRACKING_REDETECT_INTERVAL if tracking_only else detection_interval
+    if (detection_enabled or anomaly_detection_enabled) and seq % interval == 0:
+        detection_worker.submit(seq, frame)
+
+def track_faces(seq, frame, result_seq, result):
+    """Advance the face tracker by one frame, re-seeding it whenever a newer detection is available."""
+    global redetect_requested_seq
+    start = time.perf_counter()
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    if result and 'gray' in result and result_seq > face_tracker.source_seq:
+        # Seed on the detection's own frame, then track forward to this one
+        face_tracker.reset(result['gray'], result['faces'], result_seq)
+        faces = face_tracker.update(gray)
+    else:
+        faces = face_tracker.update(gray)
+        if (face_tracker.seeded_points and face_tracker.confidence < TRACKING_MIN_CONFIDENCE
+                and redetect_requested_seq != face_tracker.source_seq):
+            # Tracking is drifting or lost; ask for a fresh detection now
+            # rather than waiting for the next scheduled one
+            detection_worker.submit(seq, frame)
+            redetect_requested_seq = face_tracker.source_seq
+            tracker_stats['redetects'] += 1
+    tracker_stats['frames'] += 1
+    tracker_stats['time'] += time.perf_counter() - start
+    return faces
+
+detection_worker = DetectionWorker(analyze_frame)
+detection_worker.start()
+camera_stream.add_listener(submit_for_detection)
+
+def build_overlays(frame_seq, source_seq, faces, anomalies):
+    """Overlay description stored alongside captures instead of burning it into the pixels."""
+    return {
+        'frame_seq': frame_seq,
+        'source_seq': source_seq,
+        'faces': [[int(v) for v in rect] for rect in faces],
+        'anomalies': [[int(v) for v in circle] for circle in anomalies],
+    }
+
+def annotate_frame(seq, frame):
+    """Draw the latest detection results onto frame `seq`. Called once per frame by the encoder."""
+    global latest_overlays
+
+    # Results come from the newest finished analysis, which may be a few
+    # frames older than the one being drawn
+    result_seq, result = detection_worker.latest()
+
+    faces = result['faces'] if result else []
+    if detection_enabled and HAAR_PRESETS[detection_mode].track:
+        faces = track_faces(seq, frame, result_seq, result)
+
+    faces = faces if detection_enabled else []
+    anomalies = result['anomalies'] if anomaly_detection_enabled and result else []
+
+    # Capture frames are never modified after they are published, so with
+    # nothing to draw the frame is passed through without a copy. Overlays are
+    # drawn into a pooled buffer other than the one the encoder last rendered,
+    # which may still be being encoded for another quality profile.
+    processed_frame = frame
+    if faces or anomalies:
+        processed_frame = frame_buffers.copy_of(frame, exclude=frame_encoder.rendered)
+
+    label = 'Face'
+    for (x, y, w, h) in faces:
+        cv2.rectangle(processed_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+        cv2.putText(processed_frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+
+    for (cx, cy, r) in anomalies:
+        top_left = (cx - r, cy - r)
+        bottom_right = (cx + r, cy + r)
+        cv2.rectangle(processed_frame, top_left, bottom_right, (0, 0, 255), 3)
+
+    with frame_lock:
+        latest_overlays = build_overlays(seq, result_seq, faces, anomalies)
+
+    return processed_frame
 
-def detect_skin_anomalies(face_roi):
+def current_capture():
     """
-    Detect small white patches (electrical tape).
-    Uses color segmentation in HSV space.
-    Returns list of (center_x, center_y, radius) for detected anomalies.
+    Return (seq, pristine frame, overlays) for DICOM capture. The sensor frame
+    comes straight from the capture ring, so it needs no copy and carries no
+    drawn overlays; the overlays are those drawn on that frame if a viewer
+    rendered it, otherwise the newest detection result.
     """
+    seq, frame = camera_stream.get_latest()
+    return seq, frame, capture_overlays(seq)
+
+def capture_overlays(seq):
+    """Overlays for frame `seq`: those drawn on it if it was rendered, else the newest detection result."""
+    with frame_lock:
+        overlays = latest_overlays
+    if overlays is None or overlays['frame_seq'] != seq:
+        result_seq, result = detection_worker.latest()
+        faces = result['faces'] if detection_enabled and result else []
+        anomalies = result['anomalies'] if anomaly_detection_enabled and result else []
+        overlays = build_overlays(seq, result_seq, faces, anomalies)
+    return overlays
+
+def generate_frames(client_address):
+    # Frames come from the shared capture thread; the sequence number doubles
+    # as the frame counter so every viewer sees the same detections, and each
+    # frame is rendered once and encoded once per quality profile however
+    # many viewers are connected.
+    controller = stream_clients.register(client_address)
     try:
-        if face_roi.size == 0:
-            return []
-        
-        hsv = cv2.cvtColor(face_roi, cv2.COLOR_BGR2HSV)
-        
-        # White patch mask: stricter thresholds to avoid spurious detections
-        white_mask = cv2.inRange(hsv, (0, 0, 200), (180, 50, 255))
-        
-        # Clean mask with morphological operations
-        kernel = np.ones((3,3), np.uint8)
-        white_mask = cv2.morphologyEx(white_mask, cv2.MORPH_OPEN, kernel)
-        
-        # Find white patch contours
-        contours, _ = cv2.findContours(white_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        anomalies = []
-        for cnt in contours:
-            area = cv2.contourArea(cnt)
-            if area < 100 or area > 1000:  # Increased min area
-                continue
-            
-            # Filter by circularity to prefer round/compact shapes
-            perimeter = cv2.arcLength(cnt, True)
-            if perimeter == 0:
+        for seq, frame in camera_stream.frames():
+            if not controller.should_send():
                 continue
-            circularity = 4 * np.pi * area / (perimeter * perimeter)
-            if circularity < 0.5:  # Not too elongated
+            settings = controller.settings
+            chunk = frame_encoder.get_chunk(seq, frame, annotate_frame, settings.quality, settings.scale)
+            if chunk is None:
                 continue
-            
-            # Get bounding circle
-            (x, y), radius = cv2.minEnclosingCircle(cnt)
-            center = (int(x), int(y))
-            radius = int(radius)
-            
-            anomalies.append((center[0], center[1], radius, area))
-        
-        # Sort by area descending and take top 3
-        anomalies = sorted(anomalies, key=lambda x: x[3], reverse=True)[:3]
-        # Remove area from tuple
-        anomalies = [(x, y, r) for x, y, r, a in anomalies]
-        
-        logger.info(f"Image size: {face_roi.shape}, White contours: {len(contours)}, Anomalies: {len(anomalies)}")
-        return anomalies
-    except Exception as e:
-        logger.error(f"Error in anomaly detection: {e}")
-        return []
-
-def generate_frames():
-    global global_frame, frame_counter, last_faces
-    while True:
-        success, frame = camera.read()
-        if not success:
-            break
-
-        processed_frame = frame.copy()
-
-        frame_counter += 1
-
-        if detection_enabled:
-            interval = detection_interval
-            if frame_counter % interval == 0:
-                last_faces = detect_faces(frame, detection_mode)
-            # Use last_faces for drawing
-            label = 'Face'
-            for (x, y, w, h) in last_faces:
-                cv2.rectangle(processed_frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                cv2.putText(processed_frame, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        # Anomaly detection on entire frame
-        if anomaly_detection_enabled:
-            if frame_counter % detection_interval == 0:
-                last_anomalies = detect_skin_anomalies(frame)
-                logger.info(f"Frame {frame_counter}: Detected {len(last_anomalies)} anomalies")
-        
-        # Draw last anomalies every frame if enabled
-        if anomaly_detection_enabled:
-            for (cx, cy, r) in last_anomalies:
-                top_left = (cx - r, cy - r)
-                bottom_right = (cx + r, cy + r)
-                cv2.rectangle(processed_frame, top_left, bottom_right, (0, 0, 255), 3)
-
-        with frame_lock:
-            global_frame = processed_frame.copy()
-
-        ret, buffer = cv2.imencode('.jpg', processed_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-        yield (b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
+            # The generator is suspended while the server writes the chunk, so
+            # the time until it resumes is how long the client took to drain it
+            sent_at = time.perf_counter()
+            yield chunk
+            controller.record(time.perf_counter() - sent_at, len(chunk))
+    finally:
+        stream_clients.unregister(controller)
 
 @app.route('/')
 def index():
@@ -189,18 +234,20 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    return Response(generate_frames(request.remote_addr), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/toggle_detection')
 def toggle_detection():
     global detection_enabled
     detection_enabled = not detection_enabled
+    detection_worker.clear()
     return jsonify(enabled=detection_enabled)
 
 @app.route('/toggle_anomaly_detection')
 def toggle_anomaly_detection():
     global anomaly_detection_enabled
     anomaly_detection_enabled = not anomaly_detection_enabled
+    detection_worker.clear()
     return jsonify(enabled=anomaly_detection_enabled)
 
 @app.route('/set_detection_mode', methods=['POST'])
@@ -208,12 +255,26 @@ def set_detection_mode():
     global detection_mode
     data = request.json
     mode = data.get('mode', 'haar_balanced')
-    valid_modes = ['haar_fast', 'haar_balanced', 'haar_accurate']
-    if mode in valid_modes:
+    if mode in HAAR_PRESETS:
         detection_mode = mode
         return jsonify(success=True, mode=mode)
     return jsonify(success=False, error="Invalid mode")
 
+@app.route('/detection_stats')
+def detection_stats():
+    tracker = dict(tracker_stats)
+    tracker['avg_ms'] = 1000 * tracker['time'] / tracker['frames'] if tracker['frames'] else 0.0
+    tracker['confidence'] = face_tracker.confidence
+    return jsonify(detection=detection_worker.get_stats(), tracker=tracker, stream=frame_encoder.stats,
+                   metrics=frame_metrics.snapshot())
+
+@app.route('/stream_stats')
+def stream_stats():
+    buffers = dict(frame_buffers.stats)
+    rendered = frame_encoder.stats['rendered']
+    buffers['allocations_per_frame'] = buffers['allocations'] / rendered if rendered else 0.0
+    return jsonify(clients=stream_clients.get_stats(), encoder=frame_encoder.stats, buffers=buffers)
+
 @app.route('/control/<motor>/<direction>')
 def control_motor(motor, direction):
     steps = 50 if motor == 'm1' else 20
@@ -261,6 +322,10 @@ def emergency_stop():
         logger.error(f"Error emergency stop: {e}")
         return jsonify(success=False, error=str(e))
 
+@app.route('/motor_stats')
+def motor_stats():
+    return jsonify(moving=motor_controller.is_moving(), **motor_controller.get_stats())
+
 @app.route('/get_angles')
 def get_angles():
     try:
@@ -274,19 +339,194 @@ def get_angles():
 @app.route('/save_dicom', methods=['POST'])
 def save_dicom_route():
     data = request.json
-    with frame_lock:
-        if global_frame is None:
-            return jsonify(success=False, error="No camera frame available")
-        image_rgb = cv2.cvtColor(global_frame, cv2.COLOR_BGR2RGB)
+    seq, frame, overlays = current_capture()
+    if frame is None:
+        return jsonify(success=False, error="No camera frame available")
+    image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    # For lossy storage, reuse the stream's JPEG of this exact frame if one exists
+    jpeg = None
+    if dicom_handler.transfer_syntax == 'jpeg_baseline':
+        jpeg = frame_encoder.cached_jpeg(seq, DICOM_STREAM_JPEG_MIN_QUALITY)
 
     try:
         positions = motor_controller.get_positions()
-        fname = dicom_handler.save_as_dicom(image_rgb, data, positions)
-        return jsonify(success=True, filename=fname)
+        job_id = dicom_writer.submit(image_rgb, data, positions, overlays, jpeg)
+        return jsonify(success=True, job_id=job_id, status='queued')
+    except queue.Full:
+        logger.warning("DICOM write queue full, rejecting capture")
+        return jsonify(success=False, error="Storage busy, try again"), 503
     except Exception as e:
         logger.error(f"Error saving DICOM: {e}")
         return jsonify(success=False, error=str(e))
 
+@app.route('/save_dicom_burst', methods=['POST'])
+def save_dicom_burst_route():
+    """
+    Capture `count` distinct frames spread over `duration` seconds and queue
+    them as one DICOM series. Frames are taken from the capture ring as-is,
+    so the stream keeps running while the burst is collected.
+    """
+    data = request.json or {}
+    try:
+        count = int(data.get('count', 10))
+        duration = float(data.get('duration', 2.0))
+    except (TypeError, ValueError):
+        return jsonify(success=False, error="Invalid count/duration")
+    if not 1 <= count <= BURST_MAX_FRAMES or not 0 <= duration <= BURST_MAX_DURATION:
+        return jsonify(success=False, error=f"Burst limited to {BURST_MAX_FRAMES} frames over {BURST_MAX_DURATION}s")
+    try:
+        job_id = dicom_writer.reserve(count)
+    except queue.Full:
+        logger.warning("DICOM write queue full, rejecting burst")
+        return jsonify(success=False, error="Storage busy, try again"), 503
+
+    frames = []
+    interval = duration / (count - 1) if count > 1 else 0
+    start = time.monotonic()
+    last_seq = 0
+    for i in range(count):
+        delay = start + i * interval - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        seq, frame = camera_stream.wait_for_frame(last_seq)
+        if frame is None:
+            break
+        last_seq = seq
+        image_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frames.append((image_rgb, motor_controller.get_positions(), capture_overlays(seq)))
+    if not frames:
+        dicom_writer.fail(job_id, "No camera frame available")
+        return jsonify(success=False, error="No camera frame available")
+
+    dicom_writer.submit_series(frames, data, dicom_handler.new_series(data), job_id)
+    return jsonify(success=True, job_id=job_id, status='queued', frames=len(frames))
+
+def run_sweep(job_id, positions, metadata, stops):
+    """
+    Move the arm through `positions`, grab one pristine frame at each, and
+    queue a multi-frame DICOM. `stops` is motor_controller.stops when the
+    sweep was requested; an emergency stop after that cancels the sweep and
+    no further moves are issued.
+    """
+    capture = MultiFrameCapture()
+    try:
+        for target in positions:
+            if not motor_controller.move_to(target, stops):
+                dicom_writer.fail(job_id, "stopped")
+                return
+            if not motor_controller.wait_until_idle(SWEEP_MOVE_TIMEOUT):
+                raise RuntimeError(f"Arm did not reach {target}")
+            if motor_controller.stops != stops or not motor_controller.at_target(target):
+                logger.warning("Sweep %s stopped before reaching %s", job_id, target)
+                dicom_writer.fail(job_id, "stopped")
+                return
+            time.sleep(SWEEP_SETTLE_TIME)
+
+            # Only accept a frame exposed after the arm came to rest
+            arrived_seq, _ = camera_stream.get_latest()
+            seq, frame = camera_stream.wait_for_frame(arrived_seq)
+            if frame is None:
+                raise RuntimeError("No camera frame available")
+            capture.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), motor_controller.get_positions())
+            dicom_writer.progress(job_id, len(capture.frames))
+        dicom_writer.submit_multiframe(job_id, capture, metadata)
+    except Exception as e:
+        logger.error("Error during sweep capture: %s", e)
+        dicom_writer.fail(job_id, str(e))
+
+@app.route('/sweep_capture', methods=['POST'])
+def sweep_capture_route():
+    """
+    Capture one frame per arm position into a single multi-frame DICOM.
+    Body: patient fields plus `positions`, a list of {"m1": deg, "m2": deg}.
+    Returns a job id immediately; the sweep runs in the background.
+    """
+    data = request.json or {}
+    try:
+        positions = [{k: float(v) for k, v in p.items() if k in ('m1', 'm2')} for p in data.get('positions', [])]
+    except (AttributeError, TypeError, ValueError):
+        return jsonify(success=False, error="Invalid positions")
+    if not 1 <= len(positions) <= SWEEP_MAX_POSITIONS:
+        return jsonify(success=False, error=f"Sweep needs 1 to {SWEEP_MAX_POSITIONS} positions")
+
+    try:
+        job_id = dicom_writer.reserve(len(positions))
+    except queue.Full:
+        logger.warning("DICOM write queue full, rejecting sweep")
+        return jsonify(success=False, error="Storage busy, try again"), 503
+    threading.Thread(target=run_sweep, args=(job_id, positions, data, motor_controller.stops), daemon=True).start()
+    return jsonify(success=True, job_id=job_id, status='capturing', positions=len(positions))
+
+@app.route('/dicom_stats')
+def dicom_stats():
+    return jsonify(transfer_syntax=dicom_handler.transfer_syntax, pending=dicom_writer.pending(),
+                   queue=dicom_writer.get_stats(), per_syntax=dicom_handler.get_stats())
+
+@app.route('/dicom_jobs/<job_id>')
+def dicom_job_status(job_id):
+    job = dicom_writer.get_job(job_id)
+    if job is None:
+        return jsonify(success=False, error="Unknown job"), 404
+    return jsonify(success=True, pending=dicom_writer.pending(), **job)
+
+# Capture Browsing Routes
+@app.route('/captures')
+def list_captures():
+    """Page through indexed captures, newest first; answered from the index without opening any file."""
+    try:
+        limit = min(int(request.args.get('limit', 100)), CAPTURE_LIST_MAX_LIMIT)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify(success=False, error="limit and offset must be integers"), 400
+    if limit < 1 or offset < 0:
+        return jsonify(success=False, error="Invalid limit or offset"), 400
+    captures, total = dicom_handler.index.search(
+        patient_id=request.args.get('patient_id'),
+        study_uid=request.args.get('study_uid'),
+        series_uid=request.args.get('series_uid'),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        limit=limit, offset=offset)
+    return jsonify(success=True, total=total, limit=limit, offset=offset, captures=captures)
+
+@app.route('/captures/<sop_uid>')
+def capture_metadata(sop_uid):
+    try:
+        header = dicom_handler.read_header(sop_uid)
+    except Exception as e:
+        logger.error(f"Error reading DICOM header: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    if header is None:
+        return jsonify(success=False, error="Unknown capture"), 404
+    return jsonify(success=True, **header)
+
+@app.route('/captures/<sop_uid>/file')
+def capture_file(sop_uid):
+    filepath = dicom_handler.file_path(sop_uid)
+    if filepath is None:
+        return jsonify(success=False, error="Unknown capture"), 404
+    # conditional=True answers Range and If-None-Match requests from the file on disk
+    return send_file(filepath, mimetype='application/dicom', as_attachment=True,
+                     download_name=f"{sop_uid}.dcm", conditional=True)
+
+@app.route('/captures/<sop_uid>/thumbnail', defaults={'kind': 'thumbnail'})
+@app.route('/captures/<sop_uid>/preview', defaults={'kind': 'preview'})
+def capture_preview(sop_uid, kind):
+    # Previews are written at save time; only captures from before the cache
+    # existed, or ones since evicted, are rendered here from the DICOM file
+    if dicom_handler.index.get(sop_uid) is None:
+        return jsonify(success=False, error="Unknown capture"), 404
+    try:
+        path = preview_cache.get(sop_uid, lambda: dicom_handler.load_image(sop_uid), kind)
+    except Exception as e:
+        logger.error(f"Error generating {kind}: {e}")
+        return jsonify(success=False, error=str(e)), 500
+    return send_file(path, mimetype='image/jpeg', conditional=True, max_age=86400)
+
+@app.route('/preview_stats')
+def preview_stats():
+    return jsonify(preview_cache.get_stats())
+
 # Temi Routes
 @app.route('/temi/info')
 def temi_info():
@@ -373,4 +613,6 @@ if __name__ == '__main__':
     finally:
         logger.info("Shutting down...")
         motor_controller.stop()
-        camera.release()
+        camera_stream.stop()
+        detection_worker.stop()
+        dicom_writer.stop()